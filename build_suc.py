@@ -98,8 +98,8 @@ open_tags = sorted(
 # Create a TagLexicon object from the tag lexicon we loaded with read_dict()
 # above.
 tl = TagLexicon('SUC_lexicon', text_field, len(suc_norm_tags), open_tags, config)
-for norm, tags in suc_norm_tags.items():
-    tl[norm] = [SUC.tag_idx[tag] for tag in tags]
+tl.update((norm, [SUC.tag_idx[tag] for tag in tags])
+          for norm, tags in suc_norm_tags.items())
 
 config.build()
 
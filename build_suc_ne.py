@@ -119,8 +119,8 @@ open_tags = sorted(SUC_NE.tag_idx[tag] for tag in SUC_NE.tags)
 # above.
 tl = TagLexicon('SUC_NE_lexicon', lemma_field, len(suc_norm_ne_tags),
                 open_tags, config)
-for norm, tags in suc_norm_ne_tags.items():
-    tl[norm] = [SUC_NE.tag_idx[tag] for tag in tags]
+tl.update((norm, [SUC_NE.tag_idx[tag] for tag in tags])
+          for norm, tags in suc_norm_ne_tags.items())
 
 # Generate C code and (optionally) compile.
 config.build()
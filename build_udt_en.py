@@ -108,11 +108,11 @@ open_tags = sorted(
 
 # Create a TagLexicon object from the tag lexicon we loaded with read_dict()
 # above.
-# NOTE: although items are added one by one below, we must give the number of
+# NOTE: although items are added below, we must give the number of
 # items in the constructor: len(udt_en_norm_tags)
 tl = TagLexicon('UDT_EN_lexicon', text_field, len(udt_en_norm_tags), open_tags, config)
-for norm, tags in udt_en_norm_tags.items():
-    tl[norm] = [UDT_EN.tag_idx[tag] for tag in tags]
+tl.update((norm, [UDT_EN.tag_idx[tag] for tag in tags])
+          for norm, tags in udt_en_norm_tags.items())
 
 
 # Generate C code and (optionally) compile.
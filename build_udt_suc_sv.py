@@ -71,8 +71,8 @@ open_tags = sorted(
 # Create a TagLexicon object from the tag lexicon we loaded with read_dict()
 # above.
 tl = TagLexicon('UDT_SV_lexicon', suc_field, 0x1000, open_tags, config)
-for suc, tags in udt_sv_suc_tags.items():
-    tl[suc] = [UDT_SV.tag_idx[tag] for tag in tags]
+tl.update((suc, [UDT_SV.tag_idx[tag] for tag in tags])
+          for suc, tags in udt_sv_suc_tags.items())
 
 # Generate C code and (optionally) compile.
 config.build()
@@ -86,8 +86,8 @@ open_tags = sorted(
 # Create a TagLexicon object from the tag lexicon we loaded with read_dict()
 # above.
 tl = TagLexicon('WSJ_lexicon', text_field, len(wsj_norm_tags), open_tags, config)
-for norm, tags in wsj_norm_tags.items():
-    tl[norm] = [WSJ.tag_idx[tag] for tag in tags]
+tl.update((norm, [WSJ.tag_idx[tag] for tag in tags])
+          for norm, tags in wsj_norm_tags.items())
 
 config.build()
 
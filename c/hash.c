@@ -82,6 +82,24 @@ static inline uint64_t hash64_mix(uint64_t x, uint64_t y) {
     return y;
 }
 
+// hash32_mix(x, y) == hash32_mix_premixed(hash32_premix(x), y), so that the
+// part that only depends on x can be computed once when x is used repeatedly.
+static inline uint32_t hash32_premix(uint32_t x) {
+    return rotl32(x * 0xcc9e2d51, 15) * 0x1b873593;
+}
+
+static inline uint64_t hash64_premix(uint64_t x) {
+    return rotl64(x * 14029467366897019727ULL, 31) * 11400714785074694791ULL;
+}
+
+static inline uint32_t hash32_mix_premixed(uint32_t x, uint32_t y) {
+    return rotl32(y ^ x, 13) * 5 + 0xe6546b64;
+}
+
+static inline uint64_t hash64_mix_premixed(uint64_t x, uint64_t y) {
+    return rotl64(y ^ x, 31) * 5 + 0xbdef9f91b243c6e6ULL;
+}
+
 static inline uint32_t hash32_mix_tail(uint32_t x, uint32_t y) {
     x = rotl32(x * 0xcc9e2d51, 15) * 0x1b873593;
     return y ^ x;
@@ -27,6 +27,11 @@
 // Uncomment this to compress the weight vector after training:
 #define POST_TRAINING_COMPRESSION
 
+// Compression starts from the smallest weight vector with at least this many
+// elements per non-zero weight of the trained model, and continues with less
+// or more compression depending on the tuning error.
+#define COMPRESSION_LOAD_FACTOR 2
+
 // A non-zero value means dropout is used, but empirically this doesn't seem
 // to help
 #define DROPOUT_RATE        0
@@ -35,25 +40,87 @@
 typedef float real;
 #define REAL_MAX        FLT_MAX
 
-typedef struct {
-    uint32_t hash;
-    const void *value;
-} hash32_kv;
+// Possible values of WEIGHT_TYPE, the type of the weights in model files.
+// Training always uses real, and the final model is converted to this type.
+#define WEIGHT_FLOAT32  1
+#define WEIGHT_FLOAT16  2
+#define WEIGHT_INT8     3
+
+#if WEIGHT_TYPE == WEIGHT_FLOAT16
+// IEEE 754 half precision, converted to and from real with integer
+// operations (subnormal numbers are flushed to zero).
+typedef uint16_t weight_t;
+#define WEIGHT_MAX      ((real)65504.0)
+#elif WEIGHT_TYPE == WEIGHT_INT8
+typedef int8_t weight_t;
+#define WEIGHT_MAX      ((real)127.0)
+#else
+typedef real weight_t;
+#define WEIGHT_MAX      REAL_MAX
+#endif
 
-typedef struct {
-    uint64_t hash;
-    const void *value;
-} hash64_kv;
+static inline real weight_to_real(weight_t w) {
+#if WEIGHT_TYPE == WEIGHT_FLOAT16
+    union { uint32_t i; float f; } x;
+    x.i = (w & 0x7c00)?
+          ((uint32_t)(w & 0x8000) << 16) |
+          ((uint32_t)((w & 0x7fff) + ((127-15) << 10)) << 13) : 0;
+    return x.f;
+#else
+    return (real)w;
+#endif
+}
 
-typedef struct {
-    uint32_t hash;
-    label value;
-} hash32_kv_label;
+// Convert a value with absolute value at most WEIGHT_MAX to weight_t,
+// rounding to the nearest possible value.
+static inline weight_t real_to_weight(real r) {
+#if WEIGHT_TYPE == WEIGHT_FLOAT16
+    union { uint32_t i; float f; } x;
+    x.f = r;
+    const int exponent = (int)((x.i >> 23) & 0xff) - 127 + 15;
+    if (exponent <= 0) return 0;
+    const uint32_t h = ((uint32_t)exponent << 10) | ((x.i >> 13) & 0x3ff);
+    const uint32_t rounded = h + ((x.i >> 12) & 1);
+    return (weight_t)(((x.i >> 16) & 0x8000) |
+                      ((rounded > 0x7bff)? 0x7bff : rounded));
+#elif WEIGHT_TYPE == WEIGHT_INT8
+    return (weight_t)((r < (real)0.0)? (int)(r - (real)0.5) :
+                                       (int)(r + (real)0.5));
+#else
+    return r;
+#endif
+}
 
-typedef struct {
-    uint64_t hash;
-    label value;
-} hash64_kv_label;
+// Slot of a key in a minimal perfect hash table with n_buckets buckets and
+// size slots, see perfecthash.py (which must compute the same slots).
+static inline size_t perfect_hash(
+        uint64_t key,
+        uint64_t seed,
+        uint64_t n_buckets,
+        uint64_t size,
+        const uint32_t *displacements)
+{
+    const uint64_t a = hash64_fmix(key ^ seed);
+    const uint64_t b = hash64_fmix(a);
+    const uint32_t *d = displacements + 2*(((a >> 32) * n_buckets) >> 32);
+    const uint64_t h1 = ((b & 0xffffffff) * size) >> 32;
+    const uint64_t h2 = ((b >> 32) * size) >> 32;
+    return (h1 + d[0]*h2 + d[1]) % size;
+}
+
+// Number of candidates whose features are computed, and weights prefetched,
+// ahead of the candidate being scored in the beam search
+#define PREFETCH_DISTANCE 16
+
+// Start fetching the weights of a set of features into the cache. This is a
+// macro so that it can be used with both real and weight_t weights.
+#define prefetch_weights(hashes, len, weights, weights_len) \
+    do { \
+        size_t _i; \
+        const feat_hash_t _mask = (feat_hash_t)(weights_len) - 1; \
+        for (_i=0; _i<(len); _i++) \
+            __builtin_prefetch(&(weights)[(hashes)[_i] & _mask]); \
+    } while (0)
 
 static inline real get_score(
         const feat_hash_t *hashes,
@@ -82,6 +149,32 @@ static inline real get_score(
     }
 }
 
+// Like get_score(), but for the weights of a model file.
+static inline real get_model_score(
+        const feat_hash_t *hashes,
+        size_t len,
+        const weight_t *weights,
+        size_t weights_len,
+        int use_dropout,
+        feat_hash_t dropout_seed)
+{
+    size_t i;
+    const feat_hash_t mask = (feat_hash_t)weights_len - 1;
+    if (use_dropout) {
+        real sum = (real)0.0;
+        for (i=0; i<len; i++) {
+            const feat_hash_t h = hashes[i];
+            if (hash32_mix(dropout_seed, h) >= DROPOUT_CONSTANT)
+                sum += weight_to_real(weights[h & mask]);
+        }
+        return sum;
+    } else {
+        real sum = weight_to_real(weights[hashes[0] & mask]);
+        for (i=1; i<len; i++) sum += weight_to_real(weights[hashes[i] & mask]);
+        return sum;
+    }
+}
+
 
 #endif
 
@@ -1,16 +1,35 @@
+// Thread arrays are allocated on the stack
+#define MAX_THREADS 1024
+
 int main(int argc, const char **argv) {
+    size_t n_threads = 1;
+    if (argc >= 4 && (!strcmp(argv[1], "tag") || !strcmp(argv[1], "train")) &&
+        !strcmp(argv[2], "-j")) {
+        char *end;
+        n_threads = strtoul(argv[3], &end, 10);
+        if (*argv[3] < '0' || *argv[3] > '9' || *end ||
+            n_threads < 1 || n_threads > MAX_THREADS) {
+            fprintf(stderr, "Invalid number of threads: %s\n", argv[3]);
+            return 1;
+        }
+        // Remove the option from the argument list
+        argv[3] = argv[1];
+        argv[2] = argv[0];
+        argv += 2;
+        argc -= 2;
+    }
     if (argc == 5 && !strcmp(argv[1], "train")) {
-        if (train(argv[2], argv[3], argv[4])) return 1;
+        if (train(argv[2], argv[3], argv[4], n_threads)) return 1;
     } else if (argc == 4 && !strcmp(argv[1], "tag")) {
-        if (run(argv[2], argv[3], 0)) return 1;
+        if (run(argv[2], argv[3], 0, n_threads)) return 1;
     } else if (argc == 5 && !strcmp(argv[1], "tag") &&
                !strcmp(argv[4], "evaluate")) {
-        if (run(argv[2], argv[3], 1)) return 1;
+        if (run(argv[2], argv[3], 1, n_threads)) return 1;
     } else {
         fprintf(stderr,
                 "Usage:\n"
-                "    %s train train.txt tune.txt model.bin\n"
-                "    %s tag input.txt model.bin [evaluate]\n\n"
+                "    %s train [-j threads] train.txt tune.txt model.bin\n"
+                "    %s tag [-j threads] input.txt model.bin [evaluate]\n\n"
                 "For tagging, the input file may be \"-\" to use stdin\n\n",
                 argv[0], argv[0]);
         return 1;
@@ -0,0 +1,159 @@
+#ifndef __MODEL_C__
+#define __MODEL_C__
+
+// Model files start with a header, followed by the weights. The header is
+// MODEL_HEADER_LEN bytes long, so that the weights are aligned when the file
+// is mapped into memory. Numbers are stored in native byte order.
+// Files without a header, written before it was introduced, contain only
+// float32 weights and are still accepted by float32 taggers.
+
+#define MODEL_MAGIC         "efselab"
+#define MODEL_VERSION       1
+#define MODEL_HEADER_LEN    64
+
+typedef struct {
+    char magic[8];
+    uint32_t version;
+    // WEIGHT_FLOAT32, WEIGHT_FLOAT16 or WEIGHT_INT8
+    uint32_t weight_type;
+    uint64_t weights_len;
+    uint32_t n_features;
+    uint32_t n_invariants;
+    uint64_t tagset_hash;
+    uint64_t features_hash;
+    // The weights have been divided by this when converted to weight_t
+    float scale;
+    uint8_t padding[MODEL_HEADER_LEN - 52];
+} model_header;
+
+static void init_model_header(
+        model_header *header,
+        uint32_t weight_type,
+        size_t weights_len,
+        float scale)
+{
+    memset(header, 0, sizeof(model_header));
+    memcpy(header->magic, MODEL_MAGIC, sizeof(header->magic));
+    header->version = MODEL_VERSION;
+    header->weight_type = weight_type;
+    header->weights_len = weights_len;
+    header->n_features = N_FEATURES;
+    header->n_invariants = N_INVARIANTS;
+    header->tagset_hash = TAGSET_HASH;
+    header->features_hash = FEATURES_HASH;
+    header->scale = scale;
+}
+
+// Check that buf, of len bytes, contains a model for this tagger with weights
+// of the given type and size, and find the weights. Returns NULL if the model
+// is valid, otherwise an error message.
+static const char *check_model(
+        const void *buf,
+        size_t len,
+        uint32_t weight_type,
+        size_t weight_size,
+        const void **weights,
+        size_t *weights_len)
+{
+    const model_header *header = buf;
+    if (len < sizeof(model_header) ||
+        memcmp(header->magic, MODEL_MAGIC, sizeof(header->magic))) {
+        *weights = buf;
+        *weights_len = len / weight_size;
+        if (weight_type != WEIGHT_FLOAT32 || weight_size != sizeof(float))
+            return "Model file has no header";
+        if (*weights_len == 0 || (*weights_len & (*weights_len-1)) ||
+            len % weight_size)
+            return "Model file size not power of 2";
+        return NULL;
+    }
+
+    if (header->version != MODEL_VERSION)
+        return "Unsupported model file version";
+    if (header->weight_type != weight_type)
+        return "Model file has a different weight type than the tagger";
+    if (header->tagset_hash != TAGSET_HASH)
+        return "Model file was trained with a different tagset";
+    if (header->n_features != N_FEATURES ||
+        header->n_invariants != N_INVARIANTS ||
+        header->features_hash != FEATURES_HASH)
+        return "Model file was trained with different features";
+
+    *weights = (const uint8_t*)buf + sizeof(model_header);
+    *weights_len = header->weights_len;
+    if (*weights_len == 0 || (*weights_len & (*weights_len-1)))
+        return "Model file size not power of 2";
+    if (len != sizeof(model_header) + *weights_len*weight_size)
+        return "Model file size does not match its header";
+    return NULL;
+}
+
+// Write a model file with a header for weights of weight_type.
+static int write_model(
+        const char *model_filename,
+        const void *weights,
+        uint32_t weight_type,
+        size_t weight_size,
+        size_t weights_len,
+        float scale)
+{
+    model_header header;
+    init_model_header(&header, weight_type, weights_len, scale);
+    FILE *model = fopen(model_filename, "wb");
+    if (model == NULL) {
+        perror("unable to open model file for writing");
+        return -1;
+    }
+    if (fwrite(&header, sizeof(header), 1, model) != 1 ||
+        fwrite(weights, weight_size, weights_len, model) != weights_len) {
+        perror("unable to write model file");
+        fclose(model);
+        return -1;
+    }
+    if (fclose(model)) {
+        perror("unable to write model file");
+        return -1;
+    }
+    return 0;
+}
+
+// Read a model with real weights, as written during training.
+static real *read_model(const char *model_filename, size_t *weights_len) {
+    FILE *model = fopen(model_filename, "rb");
+    if (model == NULL) {
+        perror("unable to open model file for reading");
+        return NULL;
+    }
+    fseek(model, 0, SEEK_END);
+    const size_t len = ftell(model);
+    rewind(model);
+    uint8_t *buf = malloc(len);
+    if (buf == NULL) {
+        fprintf(stderr, "Error: unable to allocate memory\n");
+        fclose(model);
+        return NULL;
+    }
+    if (fread(buf, 1, len, model) != len) {
+        perror("unable to read model file");
+        fclose(model);
+        free(buf);
+        return NULL;
+    }
+    fclose(model);
+
+    const void *weights;
+    const char *error = check_model(
+            buf, len, WEIGHT_FLOAT32, sizeof(real), &weights, weights_len);
+    if (error != NULL) {
+        fprintf(stderr, "Error: %s: %s\n", model_filename, error);
+        free(buf);
+        return NULL;
+    }
+    real *result = malloc(sizeof(real)*(*weights_len));
+    if (result != NULL)
+        memcpy(result, weights, sizeof(real)*(*weights_len));
+    free(buf);
+    return result;
+}
+
+#endif
@@ -1,133 +1,353 @@
 #define PY_SSIZE_T_CLEAN
 #include <Python.h>
 
-static PyObject *py_tag(PyObject *self, PyObject *args) {
-    PyObject *seq;
-    Py_ssize_t buf_len;
-    const char *buf;
-    if (!PyArg_ParseTuple(args, "y#O", &buf, &buf_len, &seq)) return NULL;
-    if (buf_len & (buf_len-1)) {
-        PyErr_SetString(PyExc_ValueError,
-                "Weights vector length must be power of 2");
-        return NULL;
+// Python str objects for each tag, created once when the module is loaded.
+static PyObject *tag_objects[N_TAGS];
+
+// Get the UTF-8 contents of a bytes or str object. *bytes is set to a new
+// reference to the bytes object holding the contents (or NULL on failure),
+// and the caller is responsible for releasing it after the buffer is no longer
+// used. The reference keeps the buffer alive even if the caller's sentence is
+// modified by another thread while the GIL is released.
+static int get_field(
+        PyObject *str,
+        uint8_t **buf,
+        size_t *len,
+        PyObject **bytes)
+{
+    *bytes = NULL;
+    if (PyUnicode_Check(str)) {
+        str = PyUnicode_AsEncodedString(str, "utf-8", NULL);
+        if (str == NULL) return -1;
+    } else if (PyBytes_Check(str)) {
+        Py_INCREF(str);
+    } else {
+        PyErr_SetString(PyExc_TypeError, "Expected bytes or str");
+        return -1;
     }
-    int clear_seq = 0;
-    if (PyList_Check(seq)) {
-        seq = PyList_AsTuple(seq);
-        clear_seq = 1;
-    } else if (!PyTuple_Check(seq)) {
-        PyErr_SetString(PyExc_TypeError, "Expected a list or tuple");
-        return NULL;
+    *bytes = str;
+    if (PyBytes_GET_SIZE(str) >= MAX_STR) {
+        PyErr_Format(PyExc_ValueError,
+                "Input string too long: %zd bytes", PyBytes_GET_SIZE(str));
+        return -1;
     }
-    const real *weights = (real*)buf;
-    size_t weights_len = buf_len / sizeof(*weights);
-    Py_ssize_t seq_len = PyTuple_Size(seq), i, j;
-    uint8_t *field_buf[seq_len*N_TAG_FIELDS];
-    size_t field_len[seq_len*N_TAG_FIELDS];
-    PyObject *field_bytes[seq_len*N_TAG_FIELDS];
+    *buf = (uint8_t*)PyBytes_AS_STRING(str);
+    *len = PyBytes_GET_SIZE(str);
+    return 0;
+}
+
+// Fill field_buf and field_len (of size len(seq)*N_TAG_FIELDS) with the
+// fields of each token in seq, which must be a list or tuple.
+// References to the objects holding the fields are stored in field_bytes,
+// which must be released using release_fields() even if this function fails.
+static int get_fields(
+        PyObject *seq,
+        uint8_t **field_buf,
+        size_t *field_len,
+        PyObject **field_bytes)
+{
+    const Py_ssize_t seq_len = PySequence_Fast_GET_SIZE(seq);
+    Py_ssize_t i, j;
+
+    for (i=0; i<seq_len*N_TAG_FIELDS; i++) field_bytes[i] = NULL;
 
     for (i=0; i<seq_len; i++) {
-        PyObject *row = PyTuple_GetItem(seq, i);
+        PyObject *row = PySequence_Fast_GET_ITEM(seq, i);
         if (PyUnicode_Check(row)) {
             if (N_TAG_FIELDS != 1) {
-                char msg[0x100];
-                snprintf(msg, sizeof(msg),
+                PyErr_Format(PyExc_ValueError,
                         "Expected %d fields for token, found single string",
                         N_TAG_FIELDS);
-                PyErr_SetString(PyExc_ValueError, msg);
-                return NULL;
+                return -1;
             }
-            PyObject *buf = PyUnicode_AsEncodedString(row, "utf-8", NULL);
-            if (PyBytes_Size(buf) >= MAX_STR) {
-                char msg[0x100];
-                snprintf(msg, sizeof(msg),
-                        "Input string too long: %zd bytes",
-                        PyBytes_Size(buf));
-                PyErr_SetString(PyExc_ValueError, msg);
-                return NULL;
-            }
-            field_buf[i*N_TAG_FIELDS + 0] = (uint8_t*)PyBytes_AsString(buf);
-            field_len[i*N_TAG_FIELDS + 0] = PyBytes_Size(buf);
-            field_bytes[i*N_TAG_FIELDS + 0] = buf;
+            if (get_field(row, field_buf + i*N_TAG_FIELDS,
+                          field_len + i*N_TAG_FIELDS,
+                          field_bytes + i*N_TAG_FIELDS)) return -1;
         } else {
-            int clear_row = 0;
-            if (PyList_Check(row)) {
-                row = PyList_AsTuple(row);
-                clear_row = 1;
-            }
-            if (!PyTuple_Check(row)) {
+            if (!(PyList_Check(row) || PyTuple_Check(row))) {
                 PyErr_SetString(PyExc_TypeError,
                         "Expected tuple, list or str for token");
-                return NULL;
+                return -1;
             }
-            if (PyTuple_Size(row) != N_TAG_FIELDS) {
-                char msg[0x100];
-                snprintf(msg, sizeof(msg),
+            if (PySequence_Fast_GET_SIZE(row) != N_TAG_FIELDS) {
+                PyErr_Format(PyExc_ValueError,
                         "Expected %d fields for token, found %zd",
-                        N_TAG_FIELDS, PyTuple_Size(row));
-                PyErr_SetString(PyExc_ValueError, msg);
-                return NULL;
+                        N_TAG_FIELDS, PySequence_Fast_GET_SIZE(row));
+                return -1;
             }
             for (j=0; j<N_TAG_FIELDS; j++) {
-                PyObject *str = PyTuple_GetItem(row, j);
-                if (PyBytes_Check(str)) {
-                    if (PyBytes_Size(str) >= MAX_STR) {
-                        char msg[0x100];
-                        snprintf(msg, sizeof(msg),
-                                "Input string too long: %zd bytes",
-                                PyBytes_Size(str));
-                        PyErr_SetString(PyExc_ValueError, msg);
-                        return NULL;
-                    }
-                    field_buf[i*N_TAG_FIELDS + j] =
-                        (uint8_t*)PyBytes_AsString(str);
-                    field_len[i*N_TAG_FIELDS + j] = PyBytes_Size(str);
-                    field_bytes[i*N_TAG_FIELDS + j] = NULL;
-                } else if(PyUnicode_Check(str)) {
-                    PyObject *buf = PyUnicode_AsEncodedString(
-                            str, "utf-8", NULL);
-                    if (PyBytes_Size(buf) >= MAX_STR) {
-                        char msg[0x100];
-                        snprintf(msg, sizeof(msg),
-                                "Input string too long: %zd bytes",
-                                PyBytes_Size(buf));
-                        PyErr_SetString(PyExc_ValueError, msg);
-                        return NULL;
-                    }
-                    field_buf[i*N_TAG_FIELDS + j] =
-                        (uint8_t*)PyBytes_AsString(buf);
-                    field_len[i*N_TAG_FIELDS + j] = PyBytes_Size(buf);
-                    field_bytes[i*N_TAG_FIELDS + j] = buf;
-                } else {
-                    PyErr_SetString(PyExc_TypeError, "Expected bytes or str");
-                    return NULL;
-                }
+                if (get_field(PySequence_Fast_GET_ITEM(row, j),
+                              field_buf + i*N_TAG_FIELDS + j,
+                              field_len + i*N_TAG_FIELDS + j,
+                              field_bytes + i*N_TAG_FIELDS + j)) return -1;
             }
-            if (clear_row) Py_CLEAR(row);
         }
     }
+    return 0;
+}
 
-    label result[seq_len];
-    beam_search(
-            (const uint8_t**)field_buf, field_len, N_TAG_FIELDS,
-            seq_len, weights, weights_len, 1, 0, 0, result);
+static void release_fields(PyObject **field_bytes, size_t n) {
+    size_t i;
+    for (i=0; i<n; i++) Py_CLEAR(field_bytes[i]);
+}
+
+static int check_sentence(PyObject *seq) {
+    if (!(PyList_Check(seq) || PyTuple_Check(seq))) {
+        PyErr_SetString(PyExc_TypeError, "Expected a list or tuple");
+        return -1;
+    }
+    return 0;
+}
+
+static int get_weights(
+        const char *buf,
+        Py_ssize_t buf_len,
+        const weight_t **weights,
+        size_t *weights_len)
+{
+    const void *model_weights;
+    const char *error = check_model(buf, buf_len, WEIGHT_TYPE,
+                                    sizeof(weight_t), &model_weights,
+                                    weights_len);
+    if (error != NULL) {
+        PyErr_SetString(PyExc_ValueError, error);
+        return -1;
+    }
+    *weights = model_weights;
+    return 0;
+}
 
-    PyObject *tags = PyTuple_New(seq_len);
-    for (i=0; i<seq_len; i++)
-        PyTuple_SetItem(tags, i, PyUnicode_FromString(tag_str[result[i]]));
+// Tag a single sentence (which has been checked with check_sentence()), using
+// scratch buffers with room for at least len(seq) tokens.
+static PyObject *tag_sentence(
+        const weight_t *weights,
+        size_t weights_len,
+        PyObject *seq,
+        uint8_t **field_buf,
+        size_t *field_len,
+        PyObject **field_bytes,
+        label *result)
+{
+    const Py_ssize_t seq_len = PySequence_Fast_GET_SIZE(seq);
+    PyObject *tags = NULL;
+    Py_ssize_t i;
 
-    for (i=0; i<seq_len; i++) {
-        for (j=0; j<N_TAG_FIELDS; j++) {
-            Py_CLEAR(field_bytes[i*N_TAG_FIELDS + j]);
+    if (!get_fields(seq, field_buf, field_len, field_bytes)) {
+        // The decoder only touches the field and weight buffers, which are
+        // kept alive by the references in field_bytes and held by the
+        // caller, so other Python threads can run (and tag) meanwhile.
+        Py_BEGIN_ALLOW_THREADS
+        beam_search(
+                (const uint8_t**)field_buf, field_len, N_TAG_FIELDS,
+                seq_len, weights, weights_len, 1, 0, 0, result);
+        Py_END_ALLOW_THREADS
+
+        tags = PyTuple_New(seq_len);
+        if (tags != NULL) {
+            for (i=0; i<seq_len; i++) {
+                PyObject *tag = tag_objects[result[i]];
+                Py_INCREF(tag);
+                PyTuple_SET_ITEM(tags, i, tag);
+            }
         }
     }
-    if (clear_seq) Py_CLEAR(seq);
 
+    release_fields(field_bytes, seq_len*N_TAG_FIELDS);
     return tags;
 }
 
+static PyObject *tag_one(
+        const weight_t *weights,
+        size_t weights_len,
+        PyObject *seq)
+{
+    if (check_sentence(seq)) return NULL;
+
+    const Py_ssize_t seq_len = PySequence_Fast_GET_SIZE(seq);
+    uint8_t *field_buf[seq_len*N_TAG_FIELDS];
+    size_t field_len[seq_len*N_TAG_FIELDS];
+    PyObject *field_bytes[seq_len*N_TAG_FIELDS];
+    label result[seq_len];
+
+    return tag_sentence(weights, weights_len, seq,
+                        field_buf, field_len, field_bytes, result);
+}
+
+static PyObject *tag_many(
+        const weight_t *weights,
+        size_t weights_len,
+        PyObject *sentences)
+{
+    PyObject *list = PySequence_Fast(
+            sentences, "Expected a sequence of sentences");
+    if (list == NULL) return NULL;
+
+    // The sentences are copied to tuples, so that other threads can not
+    // make them longer than the scratch buffers while the GIL is released.
+    const Py_ssize_t n_seqs = PySequence_Fast_GET_SIZE(list);
+    PyObject *seqs = PyTuple_New(n_seqs);
+    Py_ssize_t i, max_len = 0;
+    if (seqs == NULL) {
+        Py_DECREF(list);
+        return NULL;
+    }
+    for (i=0; i<n_seqs; i++) {
+        PyObject *seq = PySequence_Fast_GET_ITEM(list, i);
+        if (check_sentence(seq) || (seq = PySequence_Tuple(seq)) == NULL) {
+            Py_DECREF(list);
+            Py_DECREF(seqs);
+            return NULL;
+        }
+        PyTuple_SET_ITEM(seqs, i, seq);
+        if (PyTuple_GET_SIZE(seq) > max_len)
+            max_len = PyTuple_GET_SIZE(seq);
+    }
+    Py_DECREF(list);
+
+    // The scratch buffers are shared by all sentences in the batch.
+    uint8_t **field_buf = PyMem_Malloc(
+            sizeof(*field_buf)*(max_len*N_TAG_FIELDS+1));
+    size_t *field_len = PyMem_Malloc(
+            sizeof(*field_len)*(max_len*N_TAG_FIELDS+1));
+    PyObject **field_bytes = PyMem_Malloc(
+            sizeof(*field_bytes)*(max_len*N_TAG_FIELDS+1));
+    label *result = PyMem_Malloc(sizeof(*result)*(max_len+1));
+    PyObject *tags_list = NULL;
+
+    if (field_buf == NULL || field_len == NULL || field_bytes == NULL ||
+        result == NULL) {
+        PyErr_NoMemory();
+        goto done;
+    }
+
+    tags_list = PyList_New(n_seqs);
+    if (tags_list == NULL) goto done;
+
+    for (i=0; i<n_seqs; i++) {
+        PyObject *tags = tag_sentence(
+                weights, weights_len, PyTuple_GET_ITEM(seqs, i),
+                field_buf, field_len, field_bytes, result);
+        if (tags == NULL) {
+            Py_CLEAR(tags_list);
+            goto done;
+        }
+        PyList_SET_ITEM(tags_list, i, tags);
+    }
+
+done:
+    PyMem_Free(field_buf);
+    PyMem_Free(field_len);
+    PyMem_Free(field_bytes);
+    PyMem_Free(result);
+    Py_DECREF(seqs);
+    return tags_list;
+}
+
+static PyObject *py_tag(PyObject *self, PyObject *args) {
+    PyObject *seq;
+    Py_ssize_t buf_len;
+    const char *buf;
+    const weight_t *weights;
+    size_t weights_len;
+    if (!PyArg_ParseTuple(args, "y#O", &buf, &buf_len, &seq)) return NULL;
+    if (get_weights(buf, buf_len, &weights, &weights_len)) return NULL;
+    return tag_one(weights, weights_len, seq);
+}
+
+static PyObject *py_tag_batch(PyObject *self, PyObject *args) {
+    PyObject *sentences;
+    Py_ssize_t buf_len;
+    const char *buf;
+    const weight_t *weights;
+    size_t weights_len;
+    if (!PyArg_ParseTuple(args, "y#O", &buf, &buf_len, &sentences))
+        return NULL;
+    if (get_weights(buf, buf_len, &weights, &weights_len)) return NULL;
+    return tag_many(weights, weights_len, sentences);
+}
+
+// Tagger objects hold a buffer with the model weights, which is validated
+// once when the object is created and kept locked until it is destroyed.
+typedef struct {
+    PyObject_HEAD
+    Py_buffer view;
+    const weight_t *weights;
+    size_t weights_len;
+} TaggerObject;
+
+static int Tagger_init(TaggerObject *self, PyObject *args, PyObject *kwds) {
+    static char *kwlist[] = { "weights", NULL };
+    Py_buffer view;
+    // Other threads may be tagging with the current weights
+    if (self->view.obj != NULL) {
+        PyErr_SetString(PyExc_ValueError, "Tagger is already initialized");
+        return -1;
+    }
+    if (!PyArg_ParseTupleAndKeywords(args, kwds, "y*", kwlist, &view))
+        return -1;
+    if (((uintptr_t)view.buf) % sizeof(weight_t)) {
+        PyErr_SetString(PyExc_ValueError, "Weights vector is not aligned");
+        PyBuffer_Release(&view);
+        return -1;
+    }
+    if (get_weights(view.buf, view.len,
+                    &self->weights, &self->weights_len)) {
+        PyBuffer_Release(&view);
+        return -1;
+    }
+    self->view = view;
+    return 0;
+}
+
+static void Tagger_dealloc(TaggerObject *self) {
+    if (self->view.obj != NULL) PyBuffer_Release(&self->view);
+    Py_TYPE(self)->tp_free((PyObject*)self);
+}
+
+static int Tagger_check(TaggerObject *self) {
+    if (self->view.obj == NULL) {
+        PyErr_SetString(PyExc_ValueError, "Tagger is not initialized");
+        return -1;
+    }
+    return 0;
+}
+
+static PyObject *Tagger_tag(TaggerObject *self, PyObject *seq) {
+    if (Tagger_check(self)) return NULL;
+    return tag_one(self->weights, self->weights_len, seq);
+}
+
+static PyObject *Tagger_tag_batch(TaggerObject *self, PyObject *sentences) {
+    if (Tagger_check(self)) return NULL;
+    return tag_many(self->weights, self->weights_len, sentences);
+}
+
+static PyMethodDef Tagger_methods[] = {
+    { "tag", (PyCFunction)Tagger_tag, METH_O, "Tag one sentence" },
+    { "tag_batch", (PyCFunction)Tagger_tag_batch, METH_O,
+        "Tag a sequence of sentences, returning a list of tag tuples" },
+    {NULL, NULL, 0, NULL}
+};
+
+static PyTypeObject TaggerType = {
+    PyVarObject_HEAD_INIT(NULL, 0)
+    .tp_name = TAGGER_NAME ".Tagger",
+    .tp_doc = "Tagger(weights)\n\n"
+              "Tagger using the model weights in a bytes-like object, "
+              "e.g. an mmap.",
+    .tp_basicsize = sizeof(TaggerObject),
+    .tp_itemsize = 0,
+    .tp_flags = Py_TPFLAGS_DEFAULT,
+    .tp_new = PyType_GenericNew,
+    .tp_init = (initproc)Tagger_init,
+    .tp_dealloc = (destructor)Tagger_dealloc,
+    .tp_methods = Tagger_methods,
+};
+
 static PyMethodDef py_methods[] = {
     { "tag", py_tag, METH_VARARGS, "Tag one sentence" },
+    { "tag_batch", py_tag_batch, METH_VARARGS,
+        "Tag a sequence of sentences, returning a list of tag tuples" },
     {NULL, NULL, 0, NULL}
 };
 
@@ -141,6 +361,22 @@ static struct PyModuleDef py_module = {
 
 PyMODINIT_FUNC
 PyInit_TAGGER_NAME(void) {
-        return PyModule_Create(&py_module);
-}
+    size_t i;
+    for (i=0; i<N_TAGS; i++) {
+        if (tag_objects[i] != NULL) continue;
+        tag_objects[i] = PyUnicode_InternFromString(tag_str[i]);
+        if (tag_objects[i] == NULL) return NULL;
+    }
+    if (PyType_Ready(&TaggerType) < 0) return NULL;
+
+    PyObject *m = PyModule_Create(&py_module);
+    if (m == NULL) return NULL;
 
+    Py_INCREF(&TaggerType);
+    if (PyModule_AddObject(m, "Tagger", (PyObject*)&TaggerType) < 0) {
+        Py_DECREF(&TaggerType);
+        Py_DECREF(m);
+        return NULL;
+    }
+    return m;
+}
@@ -1,50 +1,91 @@
 #ifndef __RUN_C__
 #define __RUN_C__
 
-static int run(
-        const char *data_filename,
+#include <fcntl.h>
+#include <unistd.h>
+#include <sys/mman.h>
+#include <sys/stat.h>
+
+// Map a model file read-only into memory. Since the mapping is shared, all
+// processes using the same model file share a single copy of it in the page
+// cache, and only the first one needs to wait for it to be read from disk.
+static const void *map_model(
         const char *model_filename,
-        int evaluate)
+        size_t *model_len)
 {
-    FILE *file = (!strcmp(data_filename, "-"))? stdin :
-                 fopen(data_filename, "rb");
-    if (file == NULL) {
-        fprintf(stderr, "Error: can not open input file %s\n", data_filename);
-        return -1;
-    }
-    FILE *model = fopen(model_filename, "rb");
-    if (model == NULL) {
+    const int fd = open(model_filename, O_RDONLY);
+    if (fd < 0) {
         fprintf(stderr, "Error: can not open model file %s\n", model_filename);
-        return -1;
+        return NULL;
     }
 
-    fseek(model, 0, SEEK_END);
-    const size_t weights_len = ftell(model) / sizeof(real);
+    struct stat st;
+    if (fstat(fd, &st)) {
+        perror("unable to get size of model file");
+        close(fd);
+        return NULL;
+    }
 
-    if (weights_len & (weights_len-1)) {
-        fprintf(stderr, "Model file size not power of 2!\n");
-        return -1;
+    *model_len = st.st_size;
+
+    if (*model_len == 0) {
+        fprintf(stderr, "Error: model file %s is empty\n", model_filename);
+        close(fd);
+        return NULL;
     }
-    rewind(model);
 
-    real *weights = malloc(sizeof(real)*weights_len);
-    if (weights == NULL) {
-        fprintf(stderr, "Error: unable to allocate weight vector memory\n");
+    void *model = mmap(NULL, *model_len, PROT_READ, MAP_SHARED, fd, 0);
+    close(fd);
+    if (model == MAP_FAILED) {
+        perror("unable to map model file");
+        return NULL;
+    }
+    // Start reading the whole file in the background, the access pattern
+    // during tagging is random so the default read-ahead does not help.
+    madvise(model, *model_len, MADV_WILLNEED);
+
+    return model;
+}
+
+static void unmap_model(const void *model, size_t model_len) {
+    munmap((void*)model, model_len);
+}
+
+static int run(
+        const char *data_filename,
+        const char *model_filename,
+        int evaluate,
+        size_t n_threads)
+{
+    FILE *file = (!strcmp(data_filename, "-"))? stdin :
+                 fopen(data_filename, "rb");
+    if (file == NULL) {
+        fprintf(stderr, "Error: can not open input file %s\n", data_filename);
         return -1;
     }
-    if (fread(weights, sizeof(real), weights_len, model) != weights_len) {
-        fprintf(stderr, "Error: unable to read weights vector\n");
+    size_t model_len, weights_len;
+    const void *model = map_model(model_filename, &model_len);
+    if (model == NULL) return -1;
+    const void *weights;
+    const char *error = check_model(model, model_len, WEIGHT_TYPE,
+                                    sizeof(weight_t), &weights, &weights_len);
+    if (error != NULL) {
+        fprintf(stderr, "Error: %s: %s\n", model_filename, error);
+        unmap_model(model, model_len);
         return -1;
     }
-    fclose(model);
 
     double error_rate = 1.0;
-    if (tag(file, weights, weights_len, stdout,
-            (evaluate)? N_TRAIN_FIELDS : N_TAG_FIELDS,
-            (evaluate)? &error_rate : NULL)) {
+    const size_t n_fields = (evaluate)? N_TRAIN_FIELDS : N_TAG_FIELDS;
+    const int rv = (n_threads > 1)?
+        tag_threads(file, weights, weights_len, stdout, n_fields,
+                    (evaluate)? &error_rate : NULL, n_threads) :
+        tag(file, weights, weights_len, stdout, n_fields,
+            (evaluate)? &error_rate : NULL);
+    if (rv) {
         fprintf(stderr, "Tagging failed!\n");
         fclose(file);
-        free(weights);
+        unmap_model(model, model_len);
         return 1;
     }
 
@@ -52,7 +93,7 @@ static int run(
         fprintf(stderr, "Error rate: %.2f%%\n", 100.0*error_rate);
 
     fclose(file);
-    free(weights);
+    unmap_model(model, model_len);
 
     return 0;
 }
@@ -1,78 +1,213 @@
 #ifndef __SEQ_C__
 #define __SEQ_C__
 
-// If the output should be aligned, set this to 1.
-#define ALIGN_FIELDS    0
-#define ALIGNMENT       (sizeof(size_t))
+#include <errno.h>
+#include <unistd.h>
 
-// If fields should be zero-terminated, set this to 1.
-#define ZERO_TERMINATE  1
+// Initial size of the blocks read by seq_reader. A block grows if a single
+// sequence does not fit into it.
+#define SEQ_BLOCK_LEN   0x400000
 
-static int read_sequence(
-        FILE *file,
+// Reads sequences of tab-separated fields from a file, one token per line
+// and an empty line after each sequence. The file is read in large blocks,
+// and fields are zero-terminated in place, so that the field pointers point
+// directly into the current block.
+typedef struct {
+    int fd;
+    uint8_t *buf;
+    size_t size;
+    size_t len;
+    size_t pos;
+    long offset;
+    int eof;
+    int error;
+} seq_reader;
+
+static int seq_reader_init(seq_reader *r, FILE *file) {
+    r->fd = fileno(file);
+    r->size = SEQ_BLOCK_LEN;
+    r->buf = malloc(r->size);
+    r->len = 0;
+    r->pos = 0;
+    r->offset = lseek(r->fd, 0, SEEK_CUR);
+    if (r->offset < 0) r->offset = 0;
+    r->eof = 0;
+    r->error = 0;
+    return (r->buf == NULL)? -1 : 0;
+}
+
+static void seq_reader_free(seq_reader *r) {
+    free(r->buf);
+    r->buf = NULL;
+}
+
+// File offset of the first sequence not read yet.
+static long seq_reader_tell(const seq_reader *r) {
+    return r->offset + (long)r->pos;
+}
+
+// Move the unread data to the start of the block and read as much data as
+// there is room for (growing the block if it is full). This invalidates the
+// fields of all sequences read from the block.
+// Returns the number of bytes read, 0 at the end of the file or -1 on errors.
+static ssize_t seq_reader_fill(seq_reader *r) {
+    if (r->pos > 0) {
+        memmove(r->buf, r->buf + r->pos, r->len - r->pos);
+        r->offset += r->pos;
+        r->len -= r->pos;
+        r->pos = 0;
+    }
+    if (r->len == r->size) {
+        uint8_t *buf = realloc(r->buf, r->size*2);
+        if (buf == NULL) {
+            r->error = 1;
+            return -1;
+        }
+        r->buf = buf;
+        r->size *= 2;
+    }
+    for (;;) {
+        const ssize_t n = read(r->fd, r->buf + r->len, r->size - r->len);
+        if (n < 0) {
+            if (errno == EINTR) continue;
+            r->error = 1;
+            return -1;
+        }
+        if (n == 0) r->eof = 1;
+        r->len += n;
+        return n;
+    }
+}
+
+// Hand over the current block to the caller in exchange for *buf (of size
+// *size, may be NULL), so that the fields of the sequences read so far stay
+// valid while reading continues.
+static int seq_reader_swap(seq_reader *r, uint8_t **buf, size_t *size) {
+    uint8_t *new_buf = *buf;
+    size_t new_size = *size;
+    if (new_size < r->size) {
+        new_buf = realloc(new_buf, r->size);
+        if (new_buf == NULL) {
+            r->error = 1;
+            return -1;
+        }
+        new_size = r->size;
+    }
+    memcpy(new_buf, r->buf + r->pos, r->len - r->pos);
+    *buf = r->buf;
+    *size = r->size;
+    r->buf = new_buf;
+    r->size = new_size;
+    r->offset += r->pos;
+    r->len -= r->pos;
+    r->pos = 0;
+    return 0;
+}
+
+// ASCII values below 10 except newline and tab are silently dropped.
+static inline int seq_dropped(uint8_t c) {
+    return c < '\t';
+}
+
+// Remove dropped bytes from the field starting at p in place, and return the
+// new end of the field.
+static uint8_t *seq_drop_bytes(uint8_t *p, uint8_t *end) {
+    uint8_t *q;
+    while (p < end && !seq_dropped(*p)) p++;
+    for (q=p; p<end; p++)
+        if (!seq_dropped(*p)) *q++ = *p;
+    return q;
+}
+
+// Parse the next sequence of the current block. *n_items is the maximum
+// number of tokens, and is set to the actual number.
+// Returns 1 if a sequence was read, 0 if the block does not contain a
+// complete sequence, and -1 for malformed input (in which case
+// seq_reader_tell() gives the offset just after the offending byte).
+static int seq_reader_next(
+        seq_reader *r,
         uint8_t **field_buf,
         size_t *field_len,
         size_t n_fields,
-        size_t *n_items,
-        uint8_t *buf,
-        size_t *buf_len)
+        size_t *n_items)
 {
-    const size_t max_items = *n_items;
-    size_t field, item, field_p = 0, buf_p = 0;
-    const size_t max_len = *buf_len;
+    uint8_t *p = r->buf + r->pos;
+    uint8_t *const end = r->buf + r->len;
+    uint8_t *seq_end = p;
+    uint8_t *nl;
+    size_t item, field, field_p = 0;
+
+    // Find the empty line ending the sequence before modifying anything, in
+    // case the sequence is incomplete and has to be parsed again later.
+    // Lines containing only dropped bytes count as empty.
+    for (;;) {
+        nl = memchr(seq_end, '\n', end - seq_end);
+        if (nl == NULL) return 0;
+        if (nl == seq_end) break;
+        if (unlikely(seq_dropped(*seq_end))) {
+            uint8_t *q = seq_end;
+            while (q < nl && seq_dropped(*q)) q++;
+            if (q == nl) break;
+        }
+        seq_end = nl + 1;
+    }
 
-    for (item=0; item<max_items; item++) {
+    for (item=0; p<seq_end; item++) {
+        if (unlikely(item >= *n_items)) goto error;
+        uint8_t *const line_end = memchr(p, '\n', seq_end - p);
         for (field=0; field<n_fields; field++) {
-#if ALIGN_FIELDS
-            while (buf_p % ALIGNMENT) buf[buf_p++] = 0;
-            if (unlikely(buf_p >= max_len)) return -1;
-#endif
-            const size_t buf_p_start = buf_p;
-            for (;;) {
-                const int c = getc_unlocked(file);
-                if (likely(c > '\n')) {
-                    if (unlikely(buf_p >= max_len)) return -1;
-                    buf[buf_p++] = c;
-                } else if (unlikely(c == '\t')) {
-                    if (unlikely(field == n_fields-1)) return -1;
-                    field_buf[field_p] = buf + buf_p_start;
-                    if ((field_len[field_p] = buf_p - buf_p_start) >= MAX_STR) {
-                        field_len[field_p] = MAX_STR-1;
-                        buf[buf_p_start + MAX_STR-1] = 0;
-                    }
-                    field_p++;
-#if ZERO_TERMINATE
-                    if (unlikely(buf_p >= max_len)) return -1;
-                    buf[buf_p++] = 0;
-#endif
-                    break;
-                } else if (unlikely(c == '\n')) {
-                    if (unlikely(field == 0 && buf_p == buf_p_start)) {
-                        *n_items = item;
-                        *buf_len = buf_p;
-                        return 0;
-                    }
-                    if (unlikely(field != n_fields-1)) return -1;
-                    field_buf[field_p] = buf + buf_p_start;
-                    if ((field_len[field_p] = buf_p - buf_p_start) >= MAX_STR) {
-                        field_len[field_p] = MAX_STR-1;
-                        buf[buf_p_start + MAX_STR-1] = 0;
-                    }
-                    field_p++;
-#if ZERO_TERMINATE
-                    if (unlikely(buf_p >= max_len)) return -1;
-                    buf[buf_p++] = 0;
-#endif
-                    break;
-                } else if (unlikely(c == EOF)) return -1;
-                // For the time being, silently drop ASCII values below 10
-                // except newline and tab.
+            uint8_t *field_end = memchr(p, '\t', line_end - p);
+            if (field == n_fields-1) {
+                if (unlikely(field_end != NULL)) {
+                    p = field_end + 1;
+                    goto error;
+                }
+                field_end = line_end;
+            } else if (unlikely(field_end == NULL)) {
+                p = line_end + 1;
+                goto error;
+            }
+            uint8_t *const text_end = seq_drop_bytes(p, field_end);
+            *text_end = 0;
+            field_buf[field_p] = p;
+            if ((field_len[field_p] = text_end - p) >= MAX_STR) {
+                field_len[field_p] = MAX_STR-1;
+                p[MAX_STR-1] = 0;
             }
+            field_p++;
+            p = field_end + 1;
         }
     }
+
+    r->pos = nl + 1 - r->buf;
+    *n_items = item;
+    return 1;
+
+error:
+    r->pos = p - r->buf;
+    r->error = 1;
     return -1;
 }
 
-#endif
-
+// Read the next sequence, reading more of the file when needed, which
+// invalidates the fields of previously read sequences.
+// Returns 0 on success, or -1 at the end of the file and on errors (in which
+// case r->error is set). An incomplete sequence at the end of the file is
+// ignored.
+static int read_sequence(
+        seq_reader *r,
+        uint8_t **field_buf,
+        size_t *field_len,
+        size_t n_fields,
+        size_t *n_items)
+{
+    for (;;) {
+        const int rv = seq_reader_next(
+                r, field_buf, field_len, n_fields, n_items);
+        if (rv > 0) return 0;
+        if (rv < 0 || r->eof) return -1;
+        if (seq_reader_fill(r) < 0) return -1;
+    }
+}
 
+#endif
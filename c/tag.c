@@ -1,36 +1,83 @@
 #ifndef __TAG_C__
 #define __TAG_C__
 
+#include <pthread.h>
+
+static void write_sequence(
+        FILE *outfile,
+        uint8_t **field_buf,
+        size_t n_fields,
+        size_t n_items,
+        const label *result)
+{
+    size_t i;
+    for (i=0; i<n_items; i++) {
+        size_t j;
+        for (j=0; j<N_TRAIN_FIELDS; j++) {
+            if (j == COL_TAG)
+                fputs((char*)tag_str[result[i]], outfile);
+            else if (j < COL_TAG)
+                fputs((char*)field_buf[i*n_fields+j], outfile);
+            else
+                fputs((char*)field_buf[i*n_fields+j-1], outfile);
+            if (j < N_TRAIN_FIELDS-1)
+                fputc('\t', outfile);
+        }
+        fputc('\n', outfile);
+    }
+    fputc('\n', outfile);
+}
+
+static size_t count_errors(
+        uint8_t **field_buf,
+        size_t n_fields,
+        size_t n_items,
+        const label *result)
+{
+    size_t i, n_errors = 0;
+    for (i=0; i<n_items; i++) {
+        const int tag = tagset_from_str(
+                (const char*)field_buf[i*n_fields + COL_TAG]);
+        if (tag < 0) {
+            fprintf(stderr, "Invalid tag: '%s'\n",
+                    field_buf[i*n_fields + COL_TAG]);
+        }
+        if (result[i] != tag) n_errors++;
+    }
+    return n_errors;
+}
+
 static int tag(
         FILE *infile,
-        const real *weights,
+        const weight_t *weights,
         size_t weights_len,
         FILE *outfile,
         size_t n_fields,
         double *error_rate)
 {
-    size_t i;
-
     const size_t max_items = 0x400;
     const size_t max_fields = max_items*n_fields;
-    size_t max_len = 0x10000;
 
     uint8_t *field_buf[max_fields];
     size_t field_len[max_fields];
     size_t n_items;
-    uint8_t buf[max_len];
 
     size_t n_total = 0, n_errors = 0;
 
+    seq_reader reader;
+    if (seq_reader_init(&reader, infile)) {
+        fprintf(stderr, "Error: unable to allocate input buffer\n");
+        return -1;
+    }
+
     for (;;) {
         n_items = max_items;
-        size_t buf_len = max_len;
         const int rv = read_sequence(
-                infile, field_buf, field_len, n_fields, &n_items,
-                buf, &buf_len);
+                &reader, field_buf, field_len, n_fields, &n_items);
         if (rv < 0) {
-            if (!feof(infile)) {
-                fprintf(stderr, "Error at %ld!\n", ftell(infile));
+            if (reader.error) {
+                fprintf(stderr, "Error at %ld!\n", seq_reader_tell(&reader));
+                seq_reader_free(&reader);
                 return -1;
             }
             break;
@@ -41,39 +88,18 @@ static int tag(
                 (const uint8_t**)field_buf, field_len, n_fields,
                 n_items, weights, weights_len, 1, 0, 0, result);
 
-        if (outfile != NULL) {
-            for (i=0; i<n_items; i++) {
-                size_t j;
-                for (j=0; j<N_TRAIN_FIELDS; j++) {
-                    if (j == COL_TAG)
-                        fputs((char*)tag_str[result[i]], outfile);
-                    else if (j < COL_TAG)
-                        fputs((char*)field_buf[i*n_fields+j], outfile);
-                    else
-                        fputs((char*)field_buf[i*n_fields+j-1], outfile);
-                    if (j < N_TRAIN_FIELDS-1)
-                        fputc('\t', outfile);
-                }
-                fputc('\n', outfile);
-            }
-            fputc('\n', outfile);
-        }
+        if (outfile != NULL)
+            write_sequence(outfile, field_buf, n_fields, n_items, result);
 
         if (error_rate != NULL) {
-            for (i=0; i<n_items; i++) {
-                const int tag = tagset_from_str(
-                        (const char*)field_buf[i*n_fields + COL_TAG]);
-                if (tag < 0) {
-                    fprintf(stderr, "Invalid tag: '%s'\n",
-                            field_buf[i*n_fields + COL_TAG]);
-                }
-                if (result[i] != tag) n_errors++;
-                n_total++;
-            }
+            n_errors += count_errors(field_buf, n_fields, n_items, result);
+            n_total += n_items;
         }
 
     }
 
+    seq_reader_free(&reader);
+
     if (error_rate != NULL) {
         if (n_total > 0) *error_rate = (double)n_errors / (double)n_total;
         else *error_rate = -1.0;
@@ -84,5 +110,181 @@ static int tag(
     return 0;
 }
 
+// Maximum number of tokens in each chunk of sentences read by tag_threads().
+// The text of the sentences is kept in a block from seq_reader.
+#define CHUNK_ITEMS     0x40000
+
+typedef struct {
+    uint8_t *buf;
+    size_t buf_size;
+    uint8_t **field_buf;
+    size_t *field_len;
+    label *result;
+    // Index of the first token of each sentence, plus one past the last
+    size_t *sent_start;
+    size_t n_sents;
+} tag_chunk;
+
+typedef struct {
+    tag_chunk *chunk;
+    const weight_t *weights;
+    size_t weights_len;
+    size_t n_fields;
+    size_t next_sent;
+} tag_job;
+
+static int alloc_chunk(tag_chunk *chunk, size_t n_fields) {
+    chunk->buf = NULL;
+    chunk->buf_size = 0;
+    chunk->field_buf = malloc(sizeof(uint8_t*)*CHUNK_ITEMS*n_fields);
+    chunk->field_len = malloc(sizeof(size_t)*CHUNK_ITEMS*n_fields);
+    chunk->result = malloc(sizeof(label)*CHUNK_ITEMS);
+    chunk->sent_start = malloc(sizeof(size_t)*(CHUNK_ITEMS+1));
+    chunk->n_sents = 0;
+    return (chunk->field_buf == NULL ||
+            chunk->field_len == NULL || chunk->result == NULL ||
+            chunk->sent_start == NULL)? -1 : 0;
+}
+
+static void free_chunk(tag_chunk *chunk) {
+    free(chunk->buf);
+    free(chunk->field_buf);
+    free(chunk->field_len);
+    free(chunk->result);
+    free(chunk->sent_start);
+}
+
+// Read all complete sentences in the current block of the reader (at least
+// one, unless the end of the file is reached) into a chunk, which takes over
+// the block. Returns -1 on errors, otherwise 0 (chunk->n_sents is 0 at the
+// end of the file).
+static int read_chunk(seq_reader *reader, tag_chunk *chunk, size_t n_fields) {
+    const size_t max_items = 0x400;
+    size_t item_p = 0;
+
+    chunk->n_sents = 0;
+    chunk->sent_start[0] = 0;
+    if (!reader->eof && seq_reader_fill(reader) < 0) return -1;
+    while (item_p + max_items <= CHUNK_ITEMS) {
+        size_t n_items = max_items;
+        const int rv = seq_reader_next(
+                reader, chunk->field_buf + item_p*n_fields,
+                chunk->field_len + item_p*n_fields, n_fields, &n_items);
+        if (rv < 0) return -1;
+        if (rv == 0) {
+            if (chunk->n_sents > 0 || reader->eof) break;
+            if (seq_reader_fill(reader) < 0) return -1;
+            continue;
+        }
+        item_p += n_items;
+        chunk->sent_start[++chunk->n_sents] = item_p;
+    }
+    if (chunk->n_sents > 0)
+        return seq_reader_swap(reader, &chunk->buf, &chunk->buf_size);
+    return 0;
+}
+
+static void *tag_worker(void *arg) {
+    tag_job *job = arg;
+    tag_chunk *chunk = job->chunk;
+    for (;;) {
+        const size_t sent = __sync_fetch_and_add(&job->next_sent, 1);
+        if (sent >= chunk->n_sents) break;
+        const size_t start = chunk->sent_start[sent];
+        beam_search(
+                (const uint8_t**)chunk->field_buf + start*job->n_fields,
+                chunk->field_len + start*job->n_fields, job->n_fields,
+                chunk->sent_start[sent+1] - start,
+                job->weights, job->weights_len, 1, 0, 0,
+                chunk->result + start);
+    }
+    return NULL;
+}
+
+// Like tag(), but the input is read in large chunks of sentences, each of
+// which is decoded by n_threads worker threads while the next chunk is being
+// read. Output is written in the same order as the input.
+static int tag_threads(
+        FILE *infile,
+        const weight_t *weights,
+        size_t weights_len,
+        FILE *outfile,
+        size_t n_fields,
+        double *error_rate,
+        size_t n_threads)
+{
+    size_t i, sent;
+    size_t n_total = 0, n_errors = 0;
+    int status = 0;
+    tag_chunk chunks[2] = { { NULL }, { NULL } };
+    pthread_t threads[n_threads];
+    tag_job job = {
+        .weights = weights,
+        .weights_len = weights_len,
+        .n_fields = n_fields
+    };
+    size_t cur = 0;
+    seq_reader reader;
+
+    if (seq_reader_init(&reader, infile) ||
+        alloc_chunk(&chunks[0], n_fields) ||
+        alloc_chunk(&chunks[1], n_fields)) {
+        fprintf(stderr, "Error: unable to allocate input buffers\n");
+        seq_reader_free(&reader);
+        free_chunk(&chunks[0]);
+        free_chunk(&chunks[1]);
+        return -1;
+    }
+
+    if (read_chunk(&reader, &chunks[cur], n_fields)) status = -1;
+
+    while (status == 0 && chunks[cur].n_sents > 0) {
+        tag_chunk *chunk = &chunks[cur];
+        job.chunk = chunk;
+        job.next_sent = 0;
+        for (i=0; i<n_threads; i++) {
+            if (pthread_create(&threads[i], NULL, tag_worker, &job)) {
+                fprintf(stderr, "Error: unable to start thread\n");
+                exit(1);
+            }
+        }
+
+        cur = 1 - cur;
+        if (read_chunk(&reader, &chunks[cur], n_fields)) status = -1;
+
+        for (i=0; i<n_threads; i++)
+            pthread_join(threads[i], NULL);
+
+        for (sent=0; sent<chunk->n_sents; sent++) {
+            const size_t start = chunk->sent_start[sent];
+            const size_t n_items = chunk->sent_start[sent+1] - start;
+            if (outfile != NULL)
+                write_sequence(outfile, chunk->field_buf + start*n_fields,
+                               n_fields, n_items, chunk->result + start);
+            if (error_rate != NULL) {
+                n_errors += count_errors(chunk->field_buf + start*n_fields,
+                                         n_fields, n_items,
+                                         chunk->result + start);
+                n_total += n_items;
+            }
+        }
+    }
+
+    if (status) fprintf(stderr, "Error at %ld!\n", seq_reader_tell(&reader));
+
+    seq_reader_free(&reader);
+    free_chunk(&chunks[0]);
+    free_chunk(&chunks[1]);
+
+    if (error_rate != NULL) {
+        if (n_total > 0) *error_rate = (double)n_errors / (double)n_total;
+        else *error_rate = -1.0;
+    }
+
+    if (outfile != NULL) fflush(outfile);
+
+    return status;
+}
+
 #endif
 
@@ -14,10 +14,241 @@ static void shuffle(size_t *items, size_t len) {
     }
 }
 
+// Training or tuning data, with the invariant hashes of each token
+// precomputed, since they do not change between iterations.
+typedef struct {
+    size_t n_sents;
+    size_t n_items;
+    // Index of the first token of each sentence, plus one past the last
+    size_t *sent_start;
+    partial_hash_t *invariant_hashes;
+    label *gold;
+} train_corpus;
+
+static void free_corpus(train_corpus *corpus) {
+    free(corpus->sent_start);
+    free(corpus->invariant_hashes);
+    free(corpus->gold);
+}
+
+static int load_corpus(
+        FILE *file,
+        const char *filename,
+        train_corpus *corpus)
+{
+    const size_t max_items = 0x400;
+    const size_t max_fields = max_items*N_TRAIN_FIELDS;
+
+    uint8_t *field_buf[max_fields];
+    size_t field_len[max_fields];
+    size_t n_items, i;
+
+    size_t max_sents = 0x10000;
+    size_t max_corpus_items = 0x100000;
+
+    corpus->n_sents = 0;
+    corpus->n_items = 0;
+    corpus->sent_start = malloc(sizeof(size_t)*(max_sents+1));
+    corpus->invariant_hashes =
+        malloc(sizeof(partial_hash_t)*max_corpus_items*N_INVARIANTS);
+    corpus->gold = malloc(sizeof(label)*max_corpus_items);
+    corpus->sent_start[0] = 0;
+
+    seq_reader reader;
+    if (seq_reader_init(&reader, file)) {
+        fprintf(stderr, "Error: unable to allocate input buffer\n");
+        return -1;
+    }
+
+    for (;;) {
+        n_items = max_items;
+        if (read_sequence(&reader, field_buf, field_len, N_TRAIN_FIELDS,
+                          &n_items) < 0) {
+            if (reader.error) {
+                fprintf(stderr, "Error at %s:%ld (bytes)!\n",
+                        filename, seq_reader_tell(&reader));
+                seq_reader_free(&reader);
+                return -1;
+            }
+            break;
+        }
+
+        if (corpus->n_sents >= max_sents) {
+            max_sents *= 2;
+            corpus->sent_start = realloc(corpus->sent_start,
+                                         sizeof(size_t)*(max_sents+1));
+        }
+        if (corpus->n_items + n_items > max_corpus_items) {
+            max_corpus_items *= 2;
+            corpus->invariant_hashes = realloc(corpus->invariant_hashes,
+                    sizeof(partial_hash_t)*max_corpus_items*N_INVARIANTS);
+            corpus->gold = realloc(corpus->gold,
+                                   sizeof(label)*max_corpus_items);
+        }
+        if (corpus->sent_start == NULL || corpus->invariant_hashes == NULL ||
+            corpus->gold == NULL) {
+            fprintf(stderr, "Error: unable to allocate memory\n");
+            seq_reader_free(&reader);
+            return -1;
+        }
+
+        if (extract_invariant(
+                (const uint8_t**)field_buf, field_len, N_TRAIN_FIELDS, n_items,
+                corpus->invariant_hashes + corpus->n_items*N_INVARIANTS)) {
+            fprintf(stderr, "Invalid UTF-8 before %s:%ld (bytes)!\n",
+                    filename, seq_reader_tell(&reader));
+            seq_reader_free(&reader);
+            return -1;
+        }
+
+        label *gold = corpus->gold + corpus->n_items;
+        for (i=0; i<n_items; i++) {
+            const int tag = tagset_from_str(
+                    (const char*)field_buf[i*N_TRAIN_FIELDS + COL_TAG]);
+            if (tag < 0) {
+                fprintf(stderr, "Invalid tag: '%s'\n",
+                        field_buf[i*N_TRAIN_FIELDS + COL_TAG]);
+            }
+            gold[i] = tag;
+        }
+
+        corpus->n_items += n_items;
+        corpus->sent_start[++corpus->n_sents] = corpus->n_items;
+    }
+
+    seq_reader_free(&reader);
+    return 0;
+}
+
+// Add together the weights whose indexes are equal modulo folded_len, which
+// must be a power of 2 (so that the folded model gives the same result as
+// the original with colliding features merged).
+static real *fold_weights(
+        const real *weights,
+        size_t weights_len,
+        size_t folded_len)
+{
+    real *folded = malloc(sizeof(real)*folded_len);
+    size_t i;
+    for (i=0; i<folded_len; i++) folded[i] = (real)0.0;
+    for (i=0; i<weights_len; i++) folded[i & (folded_len-1)] += weights[i];
+    return folded;
+}
+
+// Tag a corpus and return the proportion of incorrectly tagged tokens.
+static double corpus_error(
+        const train_corpus *corpus,
+        const real *weights,
+        size_t weights_len)
+{
+    size_t sent, i, n_errors = 0;
+    for (sent=0; sent<corpus->n_sents; sent++) {
+        const size_t start = corpus->sent_start[sent];
+        const size_t n_items = corpus->sent_start[sent+1] - start;
+        label result[n_items];
+        beam_search_invariant(
+                corpus->invariant_hashes + start*N_INVARIANTS, n_items,
+                weights, weights_len, 1, 0, 0, result);
+        for (i=0; i<n_items; i++)
+            n_errors += (result[i] != corpus->gold[start+i]);
+    }
+    if (corpus->n_items == 0) return -1.0;
+    return (double)n_errors / (double)corpus->n_items;
+}
+
+typedef struct {
+    const train_corpus *corpus;
+    const size_t *sent_order;
+    real *weights;
+    size_t weights_len;
+    double *average_weights;
+    int use_dropout;
+    feat_hash_t dropout_seed;
+    size_t next_sent;
+    size_t n_errs;
+    size_t n_total;
+} train_job;
+
+// Train on sentences taken from the job until all have been used. The i:th
+// sentence of the iteration gets the same time and dropout seed regardless
+// of the number of threads.
+// When several threads run this at the same time, they all update the same
+// weights without locking (so-called Hogwild training). Updates are sparse
+// and rarely collide, and a lost update does little harm.
+static void *train_worker(void *arg) {
+    train_job *job = arg;
+    const train_corpus *corpus = job->corpus;
+    size_t n_errs = 0, n_total = 0;
+    for (;;) {
+        const size_t sent = __sync_fetch_and_add(&job->next_sent, 1);
+        if (sent >= corpus->n_sents) break;
+        const size_t start = corpus->sent_start[job->sent_order[sent]];
+        const size_t n_items =
+            corpus->sent_start[job->sent_order[sent]+1] - start;
+
+        n_total += n_items;
+        n_errs += train_sequence(
+                corpus->invariant_hashes + start*N_INVARIANTS,
+                n_items, job->weights, job->weights_len, corpus->gold + start,
+                (real)sent, job->average_weights,
+                job->use_dropout, job->dropout_seed + sent);
+    }
+    __sync_fetch_and_add(&job->n_errs, n_errs);
+    __sync_fetch_and_add(&job->n_total, n_total);
+    return NULL;
+}
+
+#if WEIGHT_TYPE != WEIGHT_FLOAT32
+// Convert a model file from real to weight_t, scaling the weights so that the
+// largest one becomes WEIGHT_MAX. The scale does not affect tagging, which
+// only compares scores.
+static int quantize_model(
+        const char *model_filename,
+        const train_corpus *tune_data)
+{
+    size_t i, weights_len;
+    real *weights = read_model(model_filename, &weights_len);
+    if (weights == NULL) return -1;
+    weight_t *model_weights = malloc(sizeof(weight_t)*weights_len);
+    if (model_weights == NULL) {
+        fprintf(stderr, "Error: unable to allocate memory\n");
+        free(weights);
+        return -1;
+    }
+
+    real max_weight = (real)0.0;
+    for (i=0; i<weights_len; i++) {
+        if (weights[i] > max_weight) max_weight = weights[i];
+        else if (-weights[i] > max_weight) max_weight = -weights[i];
+    }
+    const real scale = (max_weight > (real)0.0)? max_weight/WEIGHT_MAX :
+                                                 (real)1.0;
+
+    // Evaluate the quantized model with the quantized values converted back,
+    // which gives the same scores as tagging with the quantized model.
+    for (i=0; i<weights_len; i++) {
+        model_weights[i] = real_to_weight(weights[i] / scale);
+        weights[i] = weight_to_real(model_weights[i]);
+    }
+    const double tune_error = corpus_error(tune_data, weights, weights_len);
+    fprintf(stderr, "Quantized model (scale %g) tuning error: %.2f%%\n",
+            (double)scale, 100.0*tune_error);
+
+    const int rv = write_model(
+            model_filename, model_weights, WEIGHT_TYPE, sizeof(weight_t),
+            weights_len, scale);
+
+    free(weights);
+    free(model_weights);
+    return rv;
+}
+#endif
+
 static int train(
         const char *train_filename,
         const char *tune_filename,
-        const char *model_filename)
+        const char *model_filename,
+        size_t n_threads)
 {
     FILE *train_file = fopen(train_filename, "rb");
     FILE *tune_file = fopen(tune_filename, "rb");
@@ -35,49 +266,19 @@ static int train(
 
     size_t i;
 
-    const size_t max_items = 0x400;
-    const size_t max_fields = max_items*N_TRAIN_FIELDS;
-    const size_t max_len = 0x10000;
-    
     double best_error_ever = 1.0;
 
-    FILE *model = NULL;
-
     feat_hash_t dropout_seed = 1;
 
-    uint8_t *field_buf[max_fields];
-    size_t field_len[max_fields];
-    size_t n_items;
-    uint8_t buf[max_len];
-
-    // First, get file offsets of sentence starts
-    size_t max_sents = 0x100000;
-    size_t n_sents;
-    long *sent_offsets = malloc(sizeof(long)*max_sents);
-
-    for (n_sents=0; ; n_sents++) {
-        if (n_sents >= max_sents) {
-            return 1;
-        }
-        sent_offsets[n_sents] = ftell(train_file);
-        n_items = max_items;
-        size_t buf_len = max_len;
-        const int rv = read_sequence(
-                train_file, field_buf, field_len, N_TRAIN_FIELDS, &n_items,
-                buf, &buf_len);
-        if (rv < 0) {
-            if (!feof(train_file)) {
-                fprintf(stderr, "Error at %s:%ld (bytes)!\n",
-                        train_filename, ftell(train_file));
-                return 1;
-            }
-            rewind(train_file);
-            break;
-        }
-    }
+    // Both data sets are only read and hashed once.
+    train_corpus train_data, tune_data;
+    if (load_corpus(train_file, train_filename, &train_data)) return 1;
+    if (load_corpus(tune_file, tune_filename, &tune_data)) return 1;
+    fclose(train_file);
+    fclose(tune_file);
 
-    sent_offsets = realloc(sent_offsets, sizeof(long)*n_sents);
-    size_t sent_order[n_sents];
+    const size_t n_sents = train_data.n_sents;
+    size_t *sent_order = malloc(sizeof(size_t)*n_sents);
     for (i=0; i<n_sents; i++) sent_order[i] = i;
 
     fprintf(stderr, "Training data contains %zd sentences\n", n_sents);
@@ -89,18 +290,15 @@ static int train(
     {
         fprintf(stderr, "Trying weight vector of size 0x%zx\n", weights_len);
         real *weights = malloc(sizeof(real)*weights_len);
-        // Even elements contain averages of the weights vector,
-        // odd elements contain the time (i.e. value of t) of the last update
-        // of the average.
-        // This is less elegant, but good for cache locality since these values
-        // are accessed randomly at the same time.
-        // TODO: might also want to get the weight vector itself into the same
-        // area.
-        double *average_weights = malloc(sizeof(double)*weights_len*2);
-        double t = 0.0;
+        // The sums of the weights vector over all training steps (i.e.
+        // unnormalized averages). During an iteration, each update of weight
+        // i at step t of the iteration subtracts t times the update, so that
+        // adding n_sents*weights[i] at the end of the iteration gives the
+        // sum. The values are integers, which are exact in a double.
+        double *average_weights = malloc(sizeof(double)*weights_len);
 
         for (i=0; i<weights_len; i++) weights[i] = (real)0.0;
-        for (i=0; i<weights_len*2; i++) average_weights[i] = 0.0;
+        for (i=0; i<weights_len; i++) average_weights[i] = 0.0;
 
         size_t iter;
         double tune_error_avg = 1.0;
@@ -114,61 +312,46 @@ static int train(
             shuffle(sent_order, n_sents);
 
             fprintf(stderr, "Iteration %zd...\n", iter+1);
-            size_t n_errs = 0;
-            size_t n_total = 0;
-            size_t sent;
-            for (sent=0; sent<n_sents; sent++) {
-                fseek(train_file, sent_offsets[sent_order[sent]], SEEK_SET);
-
-                n_items = max_items;
-                size_t buf_len = max_len;
-                const int rv = read_sequence(
-                        train_file, field_buf, field_len, N_TRAIN_FIELDS,
-                        &n_items, buf, &buf_len);
-                if (rv < 0) {
-                    fprintf(stderr, "Error at %s:%ld (bytes)!\n",
-                            train_filename, ftell(train_file));
-                    return 1;
-                }
-
-                label gold[n_items];
-                for (i=0; i<n_items; i++) {
-                    const int tag = tagset_from_str(
-                            (const char*)field_buf[i*N_TRAIN_FIELDS + COL_TAG]);
-                    if (tag < 0) {
-                        fprintf(stderr, "Invalid tag: '%s'\n",
-                                field_buf[i*N_TRAIN_FIELDS + COL_TAG]);
+            train_job job = {
+                .corpus = &train_data,
+                .sent_order = sent_order,
+                .weights = weights,
+                .weights_len = weights_len,
+                .average_weights = average_weights,
+                .use_dropout = use_dropout,
+                .dropout_seed = dropout_seed
+            };
+            if (n_threads > 1) {
+                pthread_t threads[n_threads];
+                for (i=0; i<n_threads; i++) {
+                    if (pthread_create(&threads[i], NULL, train_worker, &job)) {
+                        fprintf(stderr, "Error: unable to start thread\n");
+                        exit(1);
                     }
-                    gold[i] = tag;
                 }
-
-                n_total += n_items;
-                n_errs += train_sequence(
-                        (const uint8_t**)field_buf, field_len, N_TRAIN_FIELDS,
-                        n_items, weights, weights_len, gold,
-                        t, average_weights,
-                        use_dropout, dropout_seed);
-                t += 1.0;
-                dropout_seed++;
+                for (i=0; i<n_threads; i++)
+                    pthread_join(threads[i], NULL);
+            } else {
+                train_worker(&job);
             }
+            dropout_seed += n_sents;
 
             fprintf(stderr, "  Training error: %.2f%%\n",
-                    100.0*(double)n_errs/(double)n_total);
+                    100.0*(double)job.n_errs/(double)job.n_total);
 
+            // The averaged weights used for tuning are only allocated here,
+            // so that training itself needs 12 bytes per weight.
+            real *real_average_weights = malloc(sizeof(real)*weights_len);
+            if (real_average_weights == NULL) {
+                fprintf(stderr, "Error: unable to allocate memory\n");
+                exit(1);
+            }
             for (i=0; i<weights_len; i++) {
-                average_weights[i*2] +=
-                    (t - average_weights[i*2+1]) * (double)weights[i];
-                average_weights[i*2+1] = t;
+                average_weights[i] += (double)n_sents*(double)weights[i];
+                real_average_weights[i] = (real)average_weights[i];
             }
-
-            tune_error = 1.0;
-
-            real *real_average_weights = malloc(sizeof(real)*weights_len);
-            for (i=0; i<weights_len; i++)
-                real_average_weights[i] = (real)average_weights[i*2];
-            tag(tune_file, real_average_weights, weights_len, NULL, 
-                N_TRAIN_FIELDS, &tune_error);
-            rewind(tune_file);
+            tune_error = corpus_error(
+                    &tune_data, real_average_weights, weights_len);
 
             fprintf(stderr, "  Tuning error:   %.2f%%\n", 100.0*tune_error);
 
@@ -177,15 +360,11 @@ static int train(
 
                 fprintf(stderr, "  Best so far, writing...\n");
 
-                model = fopen(model_filename, "wb");
-                if (model == NULL) {
-                    perror("unable to open model file for writing");
+                if (write_model(model_filename, real_average_weights,
+                                WEIGHT_FLOAT32, sizeof(real), weights_len,
+                                1.0f))
                     exit(1);
-                }
-                fwrite(real_average_weights, sizeof(real), weights_len, model);
-                fclose(model);
             }
-
             free(real_average_weights);
 
             if (tune_error < best_error) {
@@ -203,54 +382,61 @@ static int train(
         }
 
         for (i=0; i<weights_len; i++)
-            weights[i] = (real)average_weights[i*2];
+            weights[i] = (real)average_weights[i];
 
         free(average_weights);
 
 #ifdef POST_TRAINING_COMPRESSION
         fprintf(stderr, "Finding optimal feature compression...\n");
 
-        model = fopen(model_filename, "rb");
-        if (model == NULL) {
-            perror("unable to open model file for reading");
-            exit(1);
-        }
-        fread(weights, sizeof(real), weights_len, model);
-        fclose(model);
-
-        size_t compressed_len = weights_len;
-        size_t compression;
-        for (compression=2; ; compression*=2) {
-            compressed_len /= 2;
-            real *folded_weights = malloc(sizeof(real)*compressed_len);
-            for (i=0; i<compressed_len; i++)
-                folded_weights[i] = weights[i] + weights[compressed_len+i];
-            tune_error = 1.0;
-            tag(tune_file, folded_weights, compressed_len, NULL, N_TRAIN_FIELDS,
-                &tune_error);
-            rewind(tune_file);
+        // The best model may be from an earlier weight vector size.
+        size_t model_len;
+        free(weights);
+        weights = read_model(model_filename, &model_len);
+        if (weights == NULL) exit(1);
+
+        size_t n_live = 0;
+        for (i=0; i<model_len; i++) n_live += (weights[i] != (real)0.0);
+        fprintf(stderr, "  0x%zx non-zero weights\n", n_live);
+
+        size_t min_len = model_len/2;
+        while (min_len > 1 && min_len/2 >= n_live*COMPRESSION_LOAD_FACTOR)
+            min_len /= 2;
+
+        // Binary search (over powers of 2) for the smallest weight vector
+        // with an acceptable tuning error, assuming that folding less never
+        // increases the error.
+        size_t compressed_len = model_len;
+        real *compressed_weights = weights;
+        while (min_len < compressed_len) {
+            size_t try_len = min_len, steps;
+            for (steps=compressed_len/min_len; steps>=4; steps/=4)
+                try_len *= 2;
+            real *folded_weights = fold_weights(weights, model_len, try_len);
+            tune_error = corpus_error(&tune_data, folded_weights, try_len);
             fprintf(stderr, "  %zdx compression tuning error: %.2f%%\n",
-                    compression, 100.0*tune_error);
+                    model_len/try_len, 100.0*tune_error);
             if (tune_error > 1.0025 * best_error) {
                 free(folded_weights);
-                fprintf(stderr, "Selected %zdx compression: 0x%zx features\n",
-                        compression/2, compressed_len*2);
-                compressed_len *= 2;
-                break;
+                min_len = try_len*2;
+            } else {
+                if (compressed_weights != weights) free(compressed_weights);
+                compressed_weights = folded_weights;
+                compressed_len = try_len;
+                if (tune_error < best_error) best_error = tune_error;
+                if (tune_error < best_error_ever) best_error_ever = tune_error;
             }
+        }
+        if (compressed_weights != weights) {
             free(weights);
-            weights = folded_weights;
-            if (tune_error < best_error) best_error = tune_error;
-            if (tune_error < best_error_ever) best_error_ever = tune_error;
+            weights = compressed_weights;
         }
+        fprintf(stderr, "Selected %zdx compression: 0x%zx features\n",
+                model_len/compressed_len, compressed_len);
 
-        model = fopen(model_filename, "wb");
-        if (model == NULL) {
-            perror("unable to open model file for writing");
+        if (write_model(model_filename, weights, WEIGHT_FLOAT32, sizeof(real),
+                        compressed_len, 1.0f))
             exit(1);
-        }
-        fwrite(weights, sizeof(real), compressed_len, model);
-        fclose(model);
 #endif
 
         free(weights);
@@ -261,8 +447,13 @@ static int train(
         }
     }
 
-    fclose(train_file);
-    fclose(tune_file);
+#if WEIGHT_TYPE != WEIGHT_FLOAT32
+    if (quantize_model(model_filename, &tune_data)) return 1;
+#endif
+
+    free(sent_order);
+    free_corpus(&train_data);
+    free_corpus(&tune_data);
 
     return 0;
 }
@@ -2,6 +2,8 @@ import os
 import sys
 from optparse import OptionParser
 
+import compression
+
 # Set some sensible defaults
 SCRIPT_DIR = os.path.abspath(os.path.dirname(__file__))
 MODEL_DIR = os.path.join(SCRIPT_DIR, "swe-pipeline")
@@ -26,6 +28,10 @@ ERROR_MESSAGES = AttrDict({
     "not_found_lemmatizer_model": "Can't find lemmatizer model file %s.",
     "not_found_maltparser": "Can't find MaltParser jar file %s.",
     "not_found_parsing_model": "Can't find parsing model: %s",
+    "invalid_jobs": "The number of jobs must be at least 1.",
+    "missing_compression_module": "Can't compress with %s, the Python module %s is not installed.",
+    "parsed_in_server": "The server can not parse, please remove --parsed.",
+    "all_in_server": "The server can not parse, please use --tokenized, --tagged, --lemmatized and --ner instead of --all.",
 })
 
 def create_parser():
@@ -71,6 +77,17 @@ def create_parser():
                   help="MaltParser model file for parsing")
     parser.add_option("--malt", dest="malt", default=MALT, metavar="JAR",
                   help=".jar file of MaltParser")
+    parser.add_option("--parser-command", dest="parser_command",
+                  metavar="COMMAND",
+                  help="Parser to use instead of MaltParser, which reads "
+                       "tagged CoNLL sentences from stdin and writes parsed "
+                       "sentences to stdout")
+    parser.add_option("-j", "--jobs", dest="jobs", type="int", default=1,
+                  metavar="N", help="Number of worker processes to use")
+    parser.add_option("--compress", dest="compress", type="choice",
+                  choices=sorted(compression.SUFFIXES), metavar="METHOD",
+                  help="Compress the output files with METHOD "
+                       "(gzip, zstd or lz4)")
     parser.add_option("--no-delete", dest="no_delete", action="store_true",
                   help="Don't delete temporary working directory.")
     return parser
@@ -93,6 +110,16 @@ def validate_options(options, args):
     if not args:
         sys.exit(ERROR_MESSAGES.no_filename)
 
+    if options.jobs < 1:
+        sys.exit(ERROR_MESSAGES.invalid_jobs)
+
+    if options.compress and not compression.is_available(options.compress):
+        sys.exit(ERROR_MESSAGES.missing_compression_module % (
+            options.compress, compression.MODULES[options.compress]))
+
+    validate_models(options)
+
+def validate_models(options):
     # Set up (part of) command lines
     jarfile = os.path.expanduser(options.malt)
 
@@ -112,8 +139,10 @@ def validate_options(options, args):
     if options.lemmatized and not os.path.exists(options.lemmatization_model):
         sys.exit(ERROR_MESSAGES.not_found_lemmatizer_model % options.lemmatization_model)
 
-    if options.parsed and not os.path.exists(jarfile):
+    use_malt = options.parsed and not options.parser_command
+
+    if use_malt and not os.path.exists(jarfile):
         sys.exit(ERROR_MESSAGES.not_found_maltparser % jarfile)
 
-    if options.parsed and not os.path.exists(options.parsing_model + ".mco"):
+    if use_malt and not os.path.exists(options.parsing_model + ".mco"):
         sys.exit(ERROR_MESSAGES.not_found_parsing_model % (options.parsing_model + ".mco"))
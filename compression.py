@@ -0,0 +1,123 @@
+"""Compressed output files.
+
+The compression is done by a background thread, so that it overlaps with
+the work of the thread writing the file. zlib, zstandard and lz4 all release
+the GIL while compressing. gzip is always available, zstd needs the
+zstandard module and lz4 the lz4 module.
+"""
+
+import importlib.util
+import queue
+import threading
+import zlib
+
+# Suffixes of compressed files, by compression method
+SUFFIXES = {"gzip": ".gz", "zstd": ".zst", "lz4": ".lz4"}
+
+# Modules needed by the compression methods
+MODULES = {"gzip": "zlib", "zstd": "zstandard", "lz4": "lz4"}
+
+
+def is_available(method):
+    return importlib.util.find_spec(MODULES[method]) is not None
+
+
+class LZ4Compressor:
+    """lz4.frame.LZ4FrameCompressor with the same interface as the others"""
+    def __init__(self):
+        import lz4.frame
+        self.compressor = lz4.frame.LZ4FrameCompressor()
+        self.header = self.compressor.begin()
+
+    def compress(self, data):
+        header, self.header = self.header, b""
+        return header + self.compressor.compress(data)
+
+    def flush(self):
+        header, self.header = self.header, b""
+        return header + self.compressor.flush()
+
+
+def make_compressor(method):
+    """Return an object with compress() and flush() methods, like the ones
+    returned by zlib.compressobj()
+    """
+    if method == "gzip":
+        # The gzip format
+        return zlib.compressobj(wbits=16 + zlib.MAX_WBITS)
+    elif method == "zstd":
+        import zstandard
+        return zstandard.ZstdCompressor().compressobj()
+    elif method == "lz4":
+        return LZ4Compressor()
+    raise ValueError("Unknown compression method: %s" % method)
+
+
+class CompressedFile:
+    """A text file which is written in UTF-8 and compressed with method.
+
+    Text is collected until there are buffer_size bytes, which are then
+    compressed and written by a background thread.
+    """
+    def __init__(self, filename, method, buffer_size=1 << 20):
+        self.compressor = make_compressor(method)
+        self.buffer_size = buffer_size
+        self.buffer = []
+        self.buffered = 0
+        self.file = open(filename, "wb")
+        # Limits the amount of data waiting for the thread
+        self.queue = queue.Queue(maxsize=2)
+        self.error = None
+        self.closed = False
+        self.thread = threading.Thread(target=self._compress, daemon=True)
+        self.thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def write(self, text):
+        data = text.encode("utf-8")
+        self.buffer.append(data)
+        self.buffered += len(data)
+        if self.buffered >= self.buffer_size:
+            self._flush_buffer()
+        return len(text)
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            self._flush_buffer()
+        finally:
+            self.queue.put(None)
+            self.thread.join()
+            self.file.close()
+        if self.error is not None:
+            raise self.error
+
+    def _flush_buffer(self):
+        if self.error is not None:
+            raise self.error
+        if self.buffer:
+            self.queue.put(b"".join(self.buffer))
+            self.buffer = []
+            self.buffered = 0
+
+    def _compress(self):
+        while True:
+            data = self.queue.get()
+            # After an error, the data is discarded until the file is closed
+            if self.error is None:
+                try:
+                    if data is None:
+                        self.file.write(self.compressor.flush())
+                    else:
+                        self.file.write(self.compressor.compress(data))
+                except Exception as e:
+                    self.error = e
+            if data is None:
+                return
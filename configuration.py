@@ -1,7 +1,28 @@
-import os, subprocess, tempfile, sys
+import os, shutil, subprocess, tempfile, sys
 
 import translation
 
+# Tags a file (without its tag column) with a Python tagger module, see
+# Configuration.profile(). Arguments: module name, model, file, tag column.
+PROFILE_SCRIPT = '''
+import importlib, sys
+sys.path.insert(0, '.')
+name, model, filename, col_tag = sys.argv[1:]
+tagger = importlib.import_module(name).Tagger(open(model, 'rb').read())
+sentences, sentence = [], []
+with open(filename, encoding='utf-8') as f:
+    for line in f:
+        fields = line.rstrip('\\n').split('\\t')
+        if fields == ['']:
+            if sentence: sentences.append(sentence)
+            sentence = []
+        else:
+            del fields[int(col_tag)]
+            sentence.append(tuple(fields))
+if sentence: sentences.append(sentence)
+tagger.tag_batch(sentences)
+'''
+
 class Configuration:
     def __init__(self, name, args):
         if not args.name is None: name = args.name
@@ -10,14 +31,18 @@ class Configuration:
         lexicon_hash_bits = partial_hash_bits
         n_train_fields = args.n_train_fields
         beam_size = args.beam_size
+        weight_type = args.weight_type
         n_tag_fields = None
         use_unicode = True
         cc = args.cc
         cflags = args.cflags.replace(r'\-', '-').split()
+        if args.march_native: cflags.append('-march=native')
 
         self.skip_compile = args.skip_compile
         self.skip_generate = args.skip_generate
         self.build_python = args.python
+        self.pgo = args.pgo
+        self.perfect_hash = args.perfect_hash
 
         # Only these values are (currently) supported
         assert partial_hash_bits in (32, 64)
@@ -35,6 +60,7 @@ class Configuration:
         self.wclexicons         = []
 
         self.beam_size          = beam_size
+        self.weight_type        = weight_type
         self.partial_hash_bits  = partial_hash_bits
         self.feat_hash_bits     = feat_hash_bits
         self.lexicon_hash_bits  = lexicon_hash_bits
@@ -58,22 +84,118 @@ class Configuration:
                 print('Generating C code to %s...' % f.name, file=sys.stderr)
                 self.c_emit(f, build_python)
                 f.flush()
-        if run_cc and not build_python:
-            command = [self.cc] + self.cflags + [
+        if run_cc and self.pgo:
+            profile_dir = tempfile.mkdtemp()
+            try:
+                self.compile(filename, build_python,
+                             ['-fprofile-generate=' + profile_dir])
+                self.profile(build_python, profile_dir)
+                self.compile(filename, build_python,
+                             ['-fprofile-use=' + profile_dir,
+                              '-fprofile-correction', '-Wno-missing-profile'])
+            finally:
+                shutil.rmtree(profile_dir)
+        elif run_cc:
+            self.compile(filename, build_python)
+
+    def compile(self, filename, build_python, extra_flags=[]):
+        # The lexicon data files are embedded with .incbin, see c_emit_data
+        data_dir = os.path.dirname(os.path.realpath(filename))
+        if not build_python:
+            command = [self.cc] + self.cflags + extra_flags + ['-pthread'] + [
+                    '-DINCBIN_LEXICONS', '-I', data_dir,
                     '-I', os.path.realpath(os.path.dirname(sys.argv[0])),
                     '-o', self.name, filename]
             print(' '.join(command), file=sys.stderr)
             subprocess.call(command)
-        elif run_cc and build_python:
+        else:
             from distutils.core import setup, Extension
             tagger = Extension(
                     self.name,
                     sources = [filename],
+                    define_macros = [('INCBIN_LEXICONS', None)],
+                    include_dirs = [data_dir],
                     libraries = [],
-                    extra_compile_args = self.cflags,
-                    extra_link_args = [])
+                    extra_compile_args = self.cflags + extra_flags + [
+                        '-pthread'],
+                    extra_link_args = extra_flags + ['-pthread'])
+            # --force, since the PGO build compiles the same file twice
             setup(name = self.name, ext_modules = [tagger],
-                  script_args = ['build_ext', '--inplace'])
+                  script_args = ['build_ext', '--inplace', '--force'])
+
+    def profile(self, build_python, work_dir):
+        """Run an instrumented tagger on the --pgo file.
+
+        The executable is profiled while training a model on the file and
+        tagging it. The Python module is profiled while tagging the file
+        with a model trained by the executable, which must have been built
+        already.
+        """
+        executable = os.path.join('.', self.name)
+        if not os.path.exists(executable):
+            raise FileNotFoundError(
+                    'the tagger executable is needed to profile the Python '
+                    'module: ' + executable)
+        model = os.path.join(work_dir, 'profile.bin')
+        print('Profiling with %s...' % self.pgo, file=sys.stderr)
+        subprocess.check_call(
+                [executable, 'train', self.pgo, self.pgo, model],
+                stdout=subprocess.DEVNULL)
+        if build_python:
+            subprocess.check_call(
+                    [sys.executable, '-c', PROFILE_SCRIPT, self.name,
+                     model, self.pgo, str(list(self.tagset.tag_fields)[0])],
+                    cwd=os.getcwd())
+        else:
+            subprocess.check_call(
+                    [executable, 'tag', self.pgo, model, 'evaluate'],
+                    stdout=subprocess.DEVNULL)
+
+    def c_emit_data(self, f, name, arrays):
+        """Write arrays of numbers to a data file, and declare them in C.
+
+        arrays is a list of (C type, C name, array.array) tuples. The arrays
+        are written as C initializers to a header file (name.lexicon.h,
+        prefixed with the tagger name), and as binary data to name.lexicon.
+        If INCBIN_LEXICONS is defined, the binary file is included into the
+        object file by the assembler instead, using the GNU .incbin
+        directive, which is much faster to compile. This requires an ELF
+        target, a GNU compatible compiler (GCC or Clang on Linux or BSD) and
+        the directory of the file in the include path, since the assembler
+        does not look for it next to the C file. The files are needed to
+        compile the generated C code, but not to run it.
+        """
+        filename = '%s-%s.lexicon' % (self.name, name)
+        header_filename = filename + '.h'
+        asm = ['.pushsection .rodata']
+        offset = 0
+        with open(filename, 'wb') as data, \
+                open(header_filename, 'w') as header:
+            for c_type, c_name, values in arrays:
+                data.write(values.tobytes())
+                size = len(values) * values.itemsize
+                asm.extend([
+                    '.balign 8',
+                    '%s:' % c_name,
+                    '.incbin \\"%s\\", %d, %d' % (filename, offset, size)])
+                offset += size
+
+                header.write('static const %s %s[%d] = {\n' % (
+                    c_type, c_name, max(1, len(values))))
+                for i in range(0, max(1, len(values)), 16):
+                    header.write('    %s,\n' % ', '.join(
+                        '%du' % x for x in values[i:i+16] or [0]))
+                header.write('};\n')
+        asm.append('.popsection')
+
+        f.write('#if defined(INCBIN_LEXICONS) && defined(__ELF__) && '
+                'defined(__GNUC__)\n')
+        for c_type, c_name, values in arrays:
+            f.write('extern const %s %s[%d];\n' % (
+                c_type, c_name, len(values)))
+        f.write('__asm__(\n%s);\n' % '\n'.join(
+            '    "%s\\n"' % line for line in asm))
+        f.write('#else\n#include "%s"\n#endif\n\n' % header_filename)
 
     def c_emit(self, f, build_python):
         def c_include(filename):
@@ -85,6 +207,7 @@ class Configuration:
 #define N_TRAIN_FIELDS  %d
 #define N_TAG_FIELDS    %d
 #define BEAM_SIZE       %d
+#define WEIGHT_TYPE     WEIGHT_%s
 #define TAGGER_NAME     "%s"
 #define PyInit_TAGGER_NAME PyInit_%s
 
@@ -95,7 +218,7 @@ typedef uint%d_t   feat_hash_t;
 typedef uint32_t   label;
 
 ''' % (self.n_train_fields, self.n_tag_fields, self.beam_size,
-       self.name, self.name,
+       self.weight_type.upper(), self.name, self.name,
        self.partial_hash_bits, self.feat_hash_bits))
 
         c_include('hash.c')
@@ -108,6 +231,13 @@ typedef uint32_t   label;
         for wcl in self.wclexicons: wcl.c_emit(f)
         self.feature_set.c_emit(f)
 
+        f.write('''
+#define TAGSET_HASH     %sULL
+#define FEATURES_HASH   %sULL
+''' % (self.tagset.fingerprint(), self.feature_set.features_hash))
+
+        c_include('model.c')
+
         c_include('seq.c')
         c_include('search.c')
         c_include('tag.c')
@@ -61,6 +61,157 @@ static PyObject *py_hashlongs64(PyObject *self, PyObject *args) {
     return PyLong_FromUnsignedLongLong(hash64_fmix(h));
 }
 
+// Longest str whose code points are copied to the stack by hashstr()
+#define HASHSTR_STACK_SIZE 256
+
+// Hash of the code points of a str, as hashlongs32/64 of the code points.
+// Strings which are not stored with 4 bytes per code point are copied to a
+// buffer on the stack if they are short, and to the heap otherwise.
+// Returns 0 and sets *h, or -1 with an exception set if out of memory.
+static int hashstr(PyObject *str, int bits, uint64_t *h) {
+    const size_t str_len = (size_t)PyUnicode_GET_LENGTH(str);
+    const int kind = PyUnicode_KIND(str);
+    const void *data = PyUnicode_DATA(str);
+    uint32_t stack_buf[HASHSTR_STACK_SIZE];
+    uint32_t *buf = stack_buf;
+    size_t i;
+
+    if (kind == PyUnicode_4BYTE_KIND) {
+        buf = (uint32_t*)data;
+    } else {
+        if (str_len > HASHSTR_STACK_SIZE) {
+            buf = PyMem_Malloc(sizeof(uint32_t)*str_len);
+            if (buf == NULL) {
+                PyErr_NoMemory();
+                return -1;
+            }
+        }
+        for (i=0; i<str_len; i++)
+            buf[i] = PyUnicode_READ(kind, data, i);
+    }
+
+    *h = (bits == 32)? hash32_fmix(hash32_partial_unicode(buf, str_len))
+                     : hash64_fmix(hash64_partial_unicode(buf, str_len));
+
+    if (buf != stack_buf && buf != data) PyMem_Free(buf);
+    return 0;
+}
+
+static PyObject *py_hashstr32(PyObject *self, PyObject *args) {
+    PyObject *str;
+    uint64_t h;
+
+    if (!PyArg_ParseTuple(args, "U", &str)) return NULL;
+    if (hashstr(str, 32, &h)) return NULL;
+
+    return PyLong_FromUnsignedLong((uint32_t)h);
+}
+
+static PyObject *py_hashstr64(PyObject *self, PyObject *args) {
+    PyObject *str;
+    uint64_t h;
+
+    if (!PyArg_ParseTuple(args, "U", &str)) return NULL;
+    if (hashstr(str, 64, &h)) return NULL;
+
+    return PyLong_FromUnsignedLongLong(h);
+}
+
+// Hashes of a sequence of strings, as an array.array of 32-bit or 64-bit
+// integers (typecode 'I' or 'Q'). If use_seed is set, str objects are hashed
+// as their UTF-8 encoding (like hash32/64), and bytes objects are accepted
+// too, otherwise the code points of str objects are hashed (like hashstr32/64).
+static PyObject *hash_many(
+        PyObject *strs,
+        int bits,
+        int use_seed,
+        uint64_t seed)
+{
+    PyObject *seq = PySequence_Fast(strs, "Expected a sequence of strings");
+    if (seq == NULL) return NULL;
+
+    const Py_ssize_t n = PySequence_Fast_GET_SIZE(seq);
+    const size_t item_size = (bits == 32)? sizeof(uint32_t) : sizeof(uint64_t);
+    uint8_t *hashes = PyMem_Malloc(item_size*n + 1);
+    PyObject *result = NULL;
+    Py_ssize_t i;
+
+    if (hashes == NULL) {
+        PyErr_NoMemory();
+        goto done;
+    }
+
+    for (i=0; i<n; i++) {
+        PyObject *str = PySequence_Fast_GET_ITEM(seq, i);
+        uint64_t h;
+        if (use_seed) {
+            const char *data;
+            Py_ssize_t len;
+            if (PyUnicode_Check(str)) {
+                data = PyUnicode_AsUTF8AndSize(str, &len);
+                if (data == NULL) goto done;
+            } else if (PyBytes_AsStringAndSize(str, (char**)&data, &len)) {
+                goto done;
+            }
+            h = (bits == 32)? hash32_data(seed, data, len)
+                            : hash64_data(seed, data, len);
+        } else {
+            if (!PyUnicode_Check(str)) {
+                PyErr_SetString(PyExc_TypeError, "Expected str");
+                goto done;
+            }
+            if (hashstr(str, bits, &h)) goto done;
+        }
+        if (bits == 32) ((uint32_t*)hashes)[i] = (uint32_t)h;
+        else ((uint64_t*)hashes)[i] = h;
+    }
+
+    PyObject *module = PyImport_ImportModule("array");
+    if (module == NULL) goto done;
+    result = PyObject_CallMethod(
+            module, "array", "sy#", (bits == 32)? "I" : "Q",
+            hashes, (Py_ssize_t)(item_size*n));
+    Py_DECREF(module);
+
+done:
+    PyMem_Free(hashes);
+    Py_DECREF(seq);
+    return result;
+}
+
+static PyObject *py_hash32_many(PyObject *self, PyObject *args) {
+    PyObject *strs;
+    unsigned long seed;
+
+    if (!PyArg_ParseTuple(args, "kO", &seed, &strs)) return NULL;
+
+    return hash_many(strs, 32, 1, seed);
+}
+
+static PyObject *py_hash64_many(PyObject *self, PyObject *args) {
+    PyObject *strs;
+    unsigned PY_LONG_LONG seed;
+
+    if (!PyArg_ParseTuple(args, "KO", &seed, &strs)) return NULL;
+
+    return hash_many(strs, 64, 1, seed);
+}
+
+static PyObject *py_hashstr32_many(PyObject *self, PyObject *args) {
+    PyObject *strs;
+
+    if (!PyArg_ParseTuple(args, "O", &strs)) return NULL;
+
+    return hash_many(strs, 32, 0, 0);
+}
+
+static PyObject *py_hashstr64_many(PyObject *self, PyObject *args) {
+    PyObject *strs;
+
+    if (!PyArg_ParseTuple(args, "O", &strs)) return NULL;
+
+    return hash_many(strs, 64, 0, 0);
+}
 
 static PyMethodDef py_methods[] = {
     { "hash32", py_hash32, METH_VARARGS, "32-bit hash" },
@@ -69,6 +220,18 @@ static PyMethodDef py_methods[] = {
         "32-bit hash (tuple of longs)" },
     { "hashlongs64", py_hashlongs64, METH_VARARGS,
         "64-bit hash (tuple of longs)" },
+    { "hashstr32", py_hashstr32, METH_VARARGS,
+        "32-bit hash (code points of str)" },
+    { "hashstr64", py_hashstr64, METH_VARARGS,
+        "64-bit hash (code points of str)" },
+    { "hash32_many", py_hash32_many, METH_VARARGS,
+        "32-bit hashes (sequence of str or bytes), as array('I')" },
+    { "hash64_many", py_hash64_many, METH_VARARGS,
+        "64-bit hashes (sequence of str or bytes), as array('Q')" },
+    { "hashstr32_many", py_hashstr32_many, METH_VARARGS,
+        "32-bit hashes (code points of sequence of str), as array('I')" },
+    { "hashstr64_many", py_hashstr64_many, METH_VARARGS,
+        "64-bit hashes (code points of sequence of str), as array('Q')" },
     {NULL, NULL, 0, NULL}
 };
 
@@ -1,6 +1,6 @@
-import sys
+import sys, io, textwrap
 from collections import defaultdict
-import hashlib, math
+import hashlib, math, re
 
 from tagset import Tag
 
@@ -98,6 +98,23 @@ class FeatureSet:
                         self._field_translations[field].add(translations)
 
     def c_emit(self, f):
+        features = io.StringIO()
+        pi_hashes_idx, signature = self.c_emit_features(features)
+        features = features.getvalue()
+        # Models are only valid for the features they were trained with, so
+        # model files contain a hash of the invariant extraction code and of
+        # the expressions computing each feature hash. The tagger name is
+        # part of some identifiers, but renaming a tagger does not change
+        # its features.
+        invariant = features[:features.index('#define N_POSITION_HASHES')]
+        self.features_hash = fixed_hash(
+                re.sub(r'\b%s_' % re.escape(self.config.name), 'TAGGER_',
+                       invariant + signature),
+                64)
+        f.write(features)
+        self.c_emit_search(f, pi_hashes_idx)
+
+    def c_emit_features(self, f):
         pi_hashes = set()
 
         f.write('''
@@ -157,7 +174,7 @@ for (i=0; i<n_items; i++) {
     if (utf8_decode(codep_buf, &codep_buf_len, field_buf[%d], field_len[%d]) < 0)
         return -1;
 ''' % (field, field))
-                    for translation, in translations:
+                    for translation, in sorted(translations):
                         trans_buf = '%s_buf' % translation
                         trans_buf_len = '%s_buf_len' % translation
                         f.write('''
@@ -218,18 +235,24 @@ return 0;
 #define N_FEATURES      %d
 ''' % (len(pi_hashes), len(pi_hashes), len(self.terms)))
 
-        f.write('''
-static void extract_features(
-        const label *history,
-        label tag,
-        size_t i,
-        size_t n_items,
-        const partial_hash_t *pi_hashes,
-        feat_hash_t *feature_hashes)
-{
-''')
-
         pi_hashes_idx = { s: i for i, s in enumerate(pi_hashes) }
+
+        # The form hashes of a template do not depend on the tags, so they
+        # are looked up (and premixed, unless last in the template) once for
+        # each position by extract_position(), rather than for each
+        # candidate by extract_features().
+        position_hashes = []
+        position_hashes_idx = {}
+        def c_position_hash(expr, premix):
+            if (expr, premix) not in position_hashes_idx:
+                position_hashes_idx[(expr, premix)] = len(position_hashes)
+                position_hashes.append((expr, premix))
+            return 'position_hashes[%d]' % position_hashes_idx[(expr, premix)]
+
+        feature_exprs = []
+        signature = []
+        # Number of previous tags used by the features
+        history_len = 0
         for idx,cons in enumerate(self.terms):
             form_cons = [con for con in cons if isinstance(con, Form)]
             tag_cons = [con for con in cons if isinstance(con, Tag)]
@@ -243,7 +266,7 @@ static void extract_features(
                             -pos, -pos, idx,
                             fixed_hash(ident, self.config.partial_hash_bits))
                 else:
-                    return ('((i < n_items-%d)? pi_hashes[(i+%d)*N_INVARIANTS'+
+                    return ('((i+%d < n_items)? pi_hashes[(i+%d)*N_INVARIANTS'+
                             ' + %d] : %s)') % (
                             pos, pos, idx,
                             fixed_hash(ident, self.config.partial_hash_bits))
@@ -259,9 +282,18 @@ static void extract_features(
             # merged into the same uintNN_t before hashing, to reduce the
             # number of mixing operations
             tag_values = [con.c_value() for con in tag_cons]
+            history_len = max(
+                    [history_len] + [-con.get_position() for con in tag_cons])
 
-            def merge_hash(xs_full):
+            def merge_hash(xs_full, premix_forms):
                 def merge_partial(xs):
+                    if premix_forms and xs[0] in form_hashes:
+                        if len(xs) == 1:
+                            return c_position_hash(xs[0], False)
+                        return 'hash%d_mix_premixed(%s, %s)' % (
+                                self.config.partial_hash_bits,
+                                c_position_hash(xs[0], True),
+                                merge_partial(xs[1:]))
                     if len(xs) == 1: return xs[0]
                     else: return 'hash%d_mix(%s, %s)' % (
                             self.config.partial_hash_bits, xs[0],
@@ -269,20 +301,105 @@ static void extract_features(
                 return 'hash%d_fmix(%s)' % (
                         self.config.feat_hash_bits, merge_partial(xs_full))
 
-            f.write('    feature_hashes[%d] = %s;\n' % (
-                idx, merge_hash([idx+1] + form_hashes + tag_values)))
+            xs = [idx+1] + form_hashes + tag_values
+            signature.append(merge_hash(xs, False))
+            feature_exprs.append(merge_hash(xs, True))
+
+        f.write('''
+#define N_POSITION_HASHES   %d
+#define HISTORY_LEN         %d
 
+static void extract_position(
+        size_t i,
+        size_t n_items,
+        const partial_hash_t *pi_hashes,
+        partial_hash_t *position_hashes)
+{
+''' % (max(1, len(position_hashes)), max(1, history_len)))
+        for idx, (expr, premix) in enumerate(position_hashes):
+            if premix:
+                expr = 'hash%d_premix(%s)' % (
+                        self.config.partial_hash_bits, expr)
+            f.write('    position_hashes[%d] = %s;\n' % (idx, expr))
+        f.write('''}
+
+static void extract_features(
+        const label *history,
+        label tag,
+        size_t i,
+        const partial_hash_t *position_hashes,
+        feat_hash_t *feature_hashes)
+{
+''')
+        for idx, expr in enumerate(feature_exprs):
+            f.write('    feature_hashes[%d] = %s;\n' % (idx, expr))
         f.write('}\n\n')
+        return pi_hashes_idx, '\n'.join(signature)
 
+    def c_emit_search(self, f, pi_hashes_idx):
         lexicon_field = self.config.lexicon.field
         normalize_idx = pi_hashes_idx.get('hash_%d_x_normalize' % lexicon_field)
 
-        f.write('''
+        def score_candidates(n_tags, tag, use_beams, update, indent):
+            # C code which scores the candidates at a position. tag is a C
+            # expression for tag number t of n_tags, and with use_beams each
+            # tag is a candidate after each beam. update is run with the
+            # score, tag and beam of each candidate, in order. The features
+            # of a candidate are computed PREFETCH_DISTANCE candidates before
+            # it is scored, so that the weights of several candidates are
+            # fetched from memory in parallel, while only a few of them are
+            # kept on the stack.
+            score = '''{
+    const label tag = candidate_tags[slot];
+%s    const real score = get_score(
+            feature_hashes[slot], N_FEATURES, weights, weights_len,
+            use_dropout, dropout_seed)%s;
+%s
+}''' % ('    const size_t beam = candidate_beams[slot];\n' if use_beams else '',
+        ' + beam_scores[beam]' if use_beams else '',
+        textwrap.indent(update, ' '*4))
+            extract = '''const size_t slot = n_candidates++ %% PREFETCH_DISTANCE;
+if (n_candidates > PREFETCH_DISTANCE) %s
+extract_features(
+        %s, new_tag, i,
+        position_hashes, feature_hashes[slot]);
+prefetch_weights(feature_hashes[slot], N_FEATURES, weights, weights_len);
+candidate_tags[slot] = new_tag;''' % (
+                score,
+                'histories[new_beam] + HISTORY_LEN' if use_beams
+                else 'result + i')
+            if use_beams:
+                extract = '''size_t new_beam;
+for (new_beam=0; new_beam<beam_size; new_beam++) {
+%s
+    candidate_beams[slot] = new_beam;
+}''' % textwrap.indent(extract, ' '*4)
+            code = '''{
+    label candidate_tags[PREFETCH_DISTANCE];
+%s    size_t n_candidates = 0, t, c;
+    for (t=0; t<%s; t++) {
+        const label new_tag = %s;
+%s
+    }
+    // Score the last candidates
+    c = (n_candidates > PREFETCH_DISTANCE)?
+        n_candidates - PREFETCH_DISTANCE : 0;
+    for (; c<n_candidates; c++) {
+        const size_t slot = c %% PREFETCH_DISTANCE;
+%s
+    }
+}''' % ('    size_t candidate_beams[PREFETCH_DISTANCE];\n' if use_beams else '',
+        n_tags, tag, textwrap.indent(extract, ' '*8),
+        textwrap.indent(score, ' '*8))
+            return textwrap.indent(code, ' '*indent).lstrip()
+
+        # The search is emitted twice: with real weights for training, and
+        # with weights of the type used in model files (weight_t) for tagging.
+        search = io.StringIO()
+        search.write('''
 #if BEAM_SIZE == 1
-static void beam_search(
-        const uint8_t **field_buf,
-        const size_t *field_len,
-        size_t n_fields,
+static void beam_search_invariant(
+        const partial_hash_t *invariant_hashes,
         size_t n_items,
         const real *weights,
         size_t weights_len,
@@ -292,74 +409,49 @@ static void beam_search(
         label *result)
 {
     size_t i;
-    feat_hash_t invariant_hashes[N_INVARIANTS*n_items];
-    feat_hash_t feature_hashes[N_FEATURES];
+    partial_hash_t position_hashes[N_POSITION_HASHES];
+    feat_hash_t feature_hashes[PREFETCH_DISTANCE][N_FEATURES];
     const label *tags;
-    extract_invariant(
-            field_buf, field_len, n_fields, n_items, invariant_hashes);
 
     for (i=0; i<n_items; i++) {
         real max_score = -REAL_MAX;
         label max_tag = 0;
+        extract_position(i, n_items, invariant_hashes, position_hashes);
 ''')
 
+        update = '''if (score > max_score) {
+    max_score = score;
+    max_tag = tag;
+}'''
         if normalize_idx is None:
             print('WARNING: no normalize(TextField(n)) for tag dictionary '
                   'key, generated files may be incorrect',
                   file=sys.stderr)
+            search.write('        ')
         else:
-            f.write('''
+            search.write('''
         if (use_lexicon) {
-            size_t j;
             tags = get_tags(hash%d_fmix(invariant_hashes[N_INVARIANTS*i + %d]));
             if (tags[0] == 1) {
                 //printf("Only tag available: %%d\\n", tags[1]);
                 max_tag = (label)tags[1];
-            } else {
-                //printf("%%d tags available\\n", tags[0]);
-                for (j=1; j<tags[0]+1; j++) {
-                    extract_features(
-                            result, tags[j], i, n_items,
-                            invariant_hashes, feature_hashes);
-                    const real score = get_score(
-                            feature_hashes, N_FEATURES, weights, weights_len,
-                            use_dropout, dropout_seed);
-                    if (score > max_score) {
-                        max_score = score;
-                        max_tag = (label)tags[j];
-                    }
-                }
-            }
-        } else {''' % (self.config.lexicon_hash_bits, normalize_idx))
-        f.write('''
-            label tag;
-            for (tag=0; tag<N_TAGS; tag++) {
-                extract_features(
-                        result, tag, i, n_items,
-                        invariant_hashes, feature_hashes);
-                const real score = get_score(
-                        feature_hashes, N_FEATURES, weights, weights_len,
-                        use_dropout, dropout_seed);
-                if (score > max_score) {
-                    max_score = score;
-                    max_tag = (label)tag;
-                }
-            }''')
-        if not normalize_idx is None:
-            f.write('\n        }')
-        f.write('''
+            } else %s
+        } else ''' % (self.config.lexicon_hash_bits, normalize_idx,
+                      score_candidates('tags[0]', '(label)tags[1 + t]',
+                                       False, update, 12)))
+        search.write(score_candidates(
+            'N_TAGS', '(label)t', False, update, 8))
+        search.write('''
         result[i] = max_tag;
     }
 }
 #endif
 ''')
 
-        f.write('''
+        search.write('''
 #if BEAM_SIZE > 1
-static void beam_search(
-        const uint8_t **field_buf,
-        const size_t *field_len,
-        size_t n_fields,
+static void beam_search_invariant(
+        const partial_hash_t *invariant_hashes,
         size_t n_items,
         const real *weights,
         size_t weights_len,
@@ -368,22 +460,26 @@ static void beam_search(
         feat_hash_t dropout_seed,
         label *result)
 {
-    size_t i;
-    feat_hash_t invariant_hashes[N_INVARIANTS*n_items];
-    feat_hash_t feature_hashes[N_FEATURES];
+    size_t i, k;
+    partial_hash_t position_hashes[N_POSITION_HASHES];
+    feat_hash_t feature_hashes[PREFETCH_DISTANCE][N_FEATURES];
     real beam_scores[BEAM_SIZE];
-    label new_beams[BEAM_SIZE][n_items];
-    label beams[BEAM_SIZE][n_items];
+    // The beams are stored as a lattice of backpointers: at position i, beam
+    // k has the tag lattice_tags[i][k] and extends beam lattice_beams[i][k]
+    // of position i-1. The last HISTORY_LEN tags of each beam are kept in
+    // histories for feature extraction.
+    label lattice_tags[n_items][BEAM_SIZE];
+    size_t lattice_beams[n_items][BEAM_SIZE];
+    label histories[BEAM_SIZE][HISTORY_LEN];
+    label new_histories[BEAM_SIZE][HISTORY_LEN];
     // this is the actual beam size, whereas BEAM_SIZE is the maximum size
     size_t beam_size = 1;
     const label *tags;
-    extract_invariant(
-            field_buf, field_len, n_fields, n_items, invariant_hashes);
 
     beam_scores[0] = (real)0.0;
+    memset(histories, 0, sizeof(histories));
 
     for (i=0; i<n_items; i++) {
-        size_t k;
         real max_score[BEAM_SIZE];
         label max_tag[BEAM_SIZE];
         size_t max_beam[BEAM_SIZE];
@@ -392,97 +488,88 @@ static void beam_search(
             max_tag[k] = 0;
             max_beam[k] = 0;
         }
+        extract_position(i, n_items, invariant_hashes, position_hashes);
 ''')
         # TODO: make a struct above, instead of 3 arrays
         # TODO: special cases for first and last step of main loop
 
+        update = '''if (score > max_score[BEAM_SIZE-1]) {
+    size_t l,m;
+    for (l=0; score < max_score[l]; l++);
+    for (m=BEAM_SIZE-1; m>l; m--) {
+        max_score[m] = max_score[m-1];
+        max_tag[m] = max_tag[m-1];
+        max_beam[m] = max_beam[m-1];
+    }
+    max_score[l] = score;
+    max_tag[l] = tag;
+    max_beam[l] = beam;
+}'''
         if normalize_idx is None:
             print('WARNING: no normalize(TextField(n)) for tag dictionary '
                   'key, generated files may be incorrect',
                   file=sys.stderr)
+            search.write('        ')
         else:
-            f.write('''
+            search.write('''
         if (use_lexicon) {
-            size_t j;
             tags = get_tags(hash%d_fmix(invariant_hashes[N_INVARIANTS*i + %d]));
-            /* if (tags[0] == 1) {
-                for (k=0; k<beam_size; k++) {
-                    max_tag[k] = tags[1];
-                    max_beam[k] = 0;
-                    max_score[k] = beam_scores[k];
-                }
-            } else */ {
-                for (j=1; j<tags[0]+1; j++) {
-                    for (k=0; k<beam_size; k++) {
-                        extract_features(
-                                beams[k], tags[j], i, n_items,
-                                invariant_hashes, feature_hashes);
-                        const real score = beam_scores[k] + get_score(
-                                feature_hashes, N_FEATURES,
-                                weights, weights_len,
-                                use_dropout, dropout_seed);
-                        if (score > max_score[BEAM_SIZE-1]) {
-                            size_t l,m;
-                            for (l=0; score < max_score[l]; l++);
-                            for (m=BEAM_SIZE-1; m>l; m--) {
-                                max_score[m] = max_score[m-1];
-                                max_tag[m] = max_tag[m-1];
-                                max_beam[m] = max_beam[m-1];
-                            }
-                            max_score[l] = score;
-                            max_tag[l] = (label)tags[j];
-                            max_beam[l] = k;
-                        }
-                    }
-                }
-            }
-        } else {''' % (self.config.lexicon_hash_bits, normalize_idx))
-        f.write('''
-            label tag;
-            for (tag=0; tag<N_TAGS; tag++) {
-                for (k=0; k<beam_size; k++) {
-                    extract_features(
-                            beams[k], tag, i, n_items,
-                            invariant_hashes, feature_hashes);
-                    const real score = beam_scores[k] + get_score(
-                            feature_hashes, N_FEATURES, weights, weights_len,
-                            use_dropout, dropout_seed);
-                    if (score > max_score[BEAM_SIZE-1]) {
-                        size_t l,m;
-                        for (l=0; score < max_score[l]; l++);
-                        for (m=BEAM_SIZE-1; m>l; m--) {
-                            max_score[m] = max_score[m-1];
-                            max_tag[m] = max_tag[m-1];
-                            max_beam[m] = max_beam[m-1];
-                        }
-                        max_score[l] = score;
-                        max_tag[l] = tag;
-                        max_beam[l] = k;
-                    }
-                }
-            }''')
-        if not normalize_idx is None:
-            f.write('\n        }')
-        # TODO: this could probably be made more efficient, since some copying
-        # is redundant.
-        f.write('''
+            %s
+        } else ''' % (self.config.lexicon_hash_bits, normalize_idx,
+                      score_candidates('tags[0]', '(label)tags[1 + t]',
+                                       True, update, 12)))
+        search.write(score_candidates(
+            'N_TAGS', '(label)t', True, update, 8))
+        search.write('''
         for (k=0; k<BEAM_SIZE && max_score[k] != -REAL_MAX; k++) {
-            beams[k][i] = max_tag[k];
+            lattice_tags[i][k] = max_tag[k];
+            lattice_beams[i][k] = max_beam[k];
             beam_scores[k] = max_score[k];
+            memcpy(new_histories[k], histories[max_beam[k]] + 1,
+                   (HISTORY_LEN-1)*sizeof(label));
+            new_histories[k][HISTORY_LEN-1] = max_tag[k];
         }
         beam_size = k;
-        if (i > 0) {
-            for (k=0; k<beam_size; k++)
-                if (max_beam[k] != k)
-                    memcpy(new_beams[k], beams[max_beam[k]], i*sizeof(label));
-            for (k=0; k<beam_size; k++)
-                if (max_beam[k] != k)
-                    memcpy(beams[k], new_beams[k], i*sizeof(label));
-        }
+        memcpy(histories, new_histories, beam_size*sizeof(histories[0]));
+    }
+    // follow the backpointers from the best beam
+    k = 0;
+    for (i=n_items; i-- > 0; ) {
+        result[i] = lattice_tags[i][k];
+        k = lattice_beams[i][k];
     }
-    memcpy(result, beams[0], n_items*sizeof(label));
 }
 #endif
+''')
+
+        search = search.getvalue()
+        f.write(search)
+        f.write(search.replace(
+            'static void beam_search_invariant(',
+            'static void beam_search_model(').replace(
+            'const real *weights,', 'const weight_t *weights,').replace(
+            'get_score(', 'get_model_score('))
+
+        f.write('''
+static void beam_search(
+        const uint8_t **field_buf,
+        const size_t *field_len,
+        size_t n_fields,
+        size_t n_items,
+        const weight_t *weights,
+        size_t weights_len,
+        int use_lexicon,
+        int use_dropout,
+        feat_hash_t dropout_seed,
+        label *result)
+{
+    partial_hash_t invariant_hashes[N_INVARIANTS*n_items];
+    extract_invariant(
+            field_buf, field_len, n_fields, n_items, invariant_hashes);
+    beam_search_model(
+            invariant_hashes, n_items, weights, weights_len,
+            use_lexicon, use_dropout, dropout_seed, result);
+}
 ''')
 
 def abstract(form): return Translation(form, 'abstract')
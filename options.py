@@ -10,6 +10,13 @@ parser.add_argument('--cc', dest='cc', type=str, default='cc',
 parser.add_argument('--cflags', dest='cflags', type=str,
     default='-Wall -Wno-unused-function -Ofast',
     help='C compiler flags')
+parser.add_argument('--march-native', action='store_true',
+    help='optimize for the CPU of this machine (-march=native)')
+parser.add_argument('--pgo', dest='pgo', type=str, default=None,
+    metavar='FILE',
+    help='profile-guided optimization: build an instrumented tagger, train '
+         'and tag with it on this tagged file (e.g. the development set), '
+         'then rebuild using the profile (GCC only)')
 parser.add_argument('--train', dest='train', type=str,
     help='training file (only used with generic model)')
 parser.add_argument('--n-train-fields', dest='n_train_fields',
@@ -20,6 +27,12 @@ parser.add_argument('--beam-size', dest='beam_size', type=int, default=4,
 parser.add_argument('--hash-bits', dest='feat_hash_bits',
     type=int, default=32,
     help='number of bits for hashes (default: 32)')
+parser.add_argument('--weight-type', dest='weight_type', type=str,
+    choices=('float32', 'float16', 'int8'), default='float32',
+    help='type of the weights in model files (default: float32)')
+parser.add_argument('--perfect-hash', action='store_true',
+    help='use minimal perfect hash tables for lexicons (slower to build, '
+         'smaller and faster to look up)')
 parser.add_argument('--skip-generate', action='store_true',
     help='compile Python module but do not generate C code (assumed to exist)')
 parser.add_argument('--skip-compile', action='store_true',
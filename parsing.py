@@ -0,0 +1,159 @@
+"""Dependency parsing in a subprocess.
+
+The parser is started once and parses all files. It reads sentences in the
+format written by conll.tagged_to_tagged_conll from its standard input, and
+writes the parsed sentences in CoNLL format to its standard output. Each
+sentence is followed by an empty line. MaltParser does this when it is run
+without input and output files, but any parser which follows this protocol
+can be used.
+"""
+
+import functools
+import os
+import queue
+import threading
+from subprocess import Popen, PIPE
+
+
+def count_sentences(lines):
+    return sum(1 for line in lines if not line.strip())
+
+
+class ParserError(Exception):
+    """The parser did not output all sentences"""
+
+
+class ParserProcess:
+    def __init__(self, cmdline, log_filename, open_output=None):
+        """Start the parser. Output files are opened for writing with
+        open_output(filename), by default as UTF-8 text files.
+        """
+        self.log_filename = log_filename
+        self.open_output = open_output or functools.partial(
+            open, mode="w", encoding="utf-8")
+        # The parser may also write to the log file itself, so its standard
+        # error is appended to the file rather than written over it
+        with open(log_filename, "a", encoding="utf-8") as log_file:
+            self.process = Popen(
+                cmdline, stdin=PIPE, stdout=PIPE, stderr=log_file,
+                encoding="utf-8"
+            )
+        # What the reader thread should do with the parser output, in the
+        # order the sentences were sent to the parser: start an output file,
+        # copy a number of sentences to it, or finish it
+        self.outputs = queue.Queue()
+        # The exception which stopped the reader thread
+        self.error = None
+        # The output is read by another thread, so that the parser can not
+        # block while writing it, even if it buffers its output
+        self.reader = threading.Thread(target=self._read_output, daemon=True)
+        self.reader.start()
+
+    def open(self, output_filename, temp_filename=None):
+        """Return a file-like object, to which sentences are written in the
+        format of conll.tagged_to_tagged_conll, in pieces of whole sentences.
+
+        The result is written to output_filename in the background, and is
+        complete when close() returns. If temp_filename is given, the result
+        is written to it and renamed to output_filename when complete. If the
+        object is closed by a with statement because of an exception, the
+        result is discarded.
+        """
+        self.outputs.put(("open", output_filename,
+                          temp_filename or output_filename))
+        return ParserInput(self)
+
+    def close(self):
+        """Wait until all sentences have been parsed, and stop the parser.
+
+        Returns the exit status of the parser, which is nonzero also if the
+        parser did not output all sentences. Other errors while writing the
+        output are raised.
+        """
+        self.outputs.put(None)
+        try:
+            self.process.stdin.close()
+        except BrokenPipeError:
+            pass
+        self.reader.join()
+        returncode = self.process.wait()
+        if self.error is not None and not isinstance(self.error, ParserError):
+            raise self.error
+        return returncode or (1 if self.error else 0)
+
+    def _write(self, text):
+        # After an error, the sentences are discarded until the parser is
+        # closed, which reports the error
+        if self.error is not None:
+            return
+        self.outputs.put(("parse", count_sentences(text.splitlines())))
+        try:
+            self.process.stdin.write(text)
+        except BrokenPipeError:
+            # The parser has exited, which close() reports
+            pass
+
+    def _read_output(self):
+        output = None
+        try:
+            while True:
+                item = self.outputs.get()
+                if item is None:
+                    return
+                if item[0] == "open":
+                    _, output_filename, temp_filename = item
+                    output = self.open_output(temp_filename)
+                elif item[0] == "parse":
+                    self._copy_sentences(output, item[1])
+                else:
+                    output.close()
+                    output = None
+                    if item[1]:
+                        os.replace(temp_filename, output_filename)
+                    else:
+                        os.remove(temp_filename)
+        except Exception as e:
+            self.error = e
+            # Nothing reads the parser output any more, so the parser is
+            # stopped before it blocks, and with it the thread writing input
+            self.process.kill()
+            if output is not None:
+                # Do not leave a partial output file behind
+                try:
+                    output.close()
+                finally:
+                    os.remove(temp_filename)
+
+    def _copy_sentences(self, output, n_sentences):
+        while n_sentences:
+            line = self.process.stdout.readline()
+            if not line:
+                raise ParserError("Parser output ended unexpectedly")
+            output.write(line)
+            if not line.strip():
+                n_sentences -= 1
+
+
+class ParserInput:
+    """The input of one output file, returned by ParserProcess.open()"""
+    def __init__(self, parser):
+        self.parser = parser
+        self.closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *args):
+        self._finish(exc_type is None)
+
+    def write(self, text):
+        self.parser._write(text)
+        return len(text)
+
+    def close(self):
+        self._finish(True)
+
+    def _finish(self, complete):
+        if not self.closed:
+            self.closed = True
+            self.parser.outputs.put(("close", complete))
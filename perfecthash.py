@@ -0,0 +1,113 @@
+"""Minimal perfect hash tables for the lexicons.
+
+The keys (which are already hashes of strings) are divided into buckets, and
+each bucket gets a displacement which moves its keys to free slots of a table
+with exactly one slot per key (the CHD algorithm, Belazzougui et al. 2009).
+Looking up a key then needs one access to the displacements and one to the
+table. The generated C code uses perfect_hash() in headers.h, which must
+compute the same slots as PerfectHash.slot().
+"""
+
+from array import array
+import random
+
+MASK64 = (1 << 64) - 1
+
+
+def fmix64(x):
+    """Same as hash64_fmix() in hash.c"""
+    x = ((x ^ (x >> 33)) * 14029467366897019727) & MASK64
+    x = ((x ^ (x >> 29)) * 1609587929392839161) & MASK64
+    return x ^ (x >> 32)
+
+
+class PerfectHash:
+    # Average number of keys per bucket
+    bucket_size = 3
+    # Largest first displacement (the multiple of the second hash)
+    max_d0 = 0x100
+    # Number of second displacements tried for each first displacement
+    n_d1_tries = 0x40
+
+    def __init__(self, keys, seed=0):
+        """Build a table for a list of distinct keys (64-bit integers).
+
+        self.keys lists the keys in the order of their slots, and
+        self.displacements contains two integers for each bucket.
+        """
+        assert len(set(keys)) == len(keys), 'Keys are not distinct'
+        assert len(keys) < (1 << 32), 'Too many keys'
+        self.size = max(1, len(keys))
+        self.n_buckets = max(1, -(-len(keys) // self.bucket_size))
+
+        rng = random.Random(seed)
+        for _ in range(100):
+            self.seed = rng.getrandbits(64)
+            if self._build(keys, rng): return
+        raise ValueError('Unable to build a perfect hash table')
+
+    def _hashes(self, key):
+        a = fmix64(key ^ self.seed)
+        b = fmix64(a)
+        return (((a >> 32) * self.n_buckets) >> 32,
+                ((b & 0xffffffff) * self.size) >> 32,
+                ((b >> 32) * self.size) >> 32)
+
+    def slot(self, key):
+        bucket, h1, h2 = self._hashes(key)
+        d0 = self.displacements[2*bucket]
+        d1 = self.displacements[2*bucket + 1]
+        return (h1 + d0*h2 + d1) % self.size
+
+    def _build(self, keys, rng):
+        buckets = [[] for _ in range(self.n_buckets)]
+        for key in keys:
+            bucket, h1, h2 = self._hashes(key)
+            buckets[bucket].append((key, h1, h2))
+
+        self.displacements = array('I', [0]) * (2*self.n_buckets)
+        self.keys = [None] * self.size
+        used = bytearray(self.size)
+        # The free slots, in any order, and the index of each in the list
+        free = list(range(self.size))
+        free_idx = list(range(self.size))
+        uniform = rng.random
+
+        def take(slot):
+            used[slot] = 1
+            i = free_idx[slot]
+            free[i] = free[-1]
+            free_idx[free[i]] = i
+            free.pop()
+
+        # The largest buckets are placed first, while most slots are free
+        order = sorted(range(self.n_buckets), key=lambda b: -len(buckets[b]))
+        for bucket in order:
+            items = buckets[bucket]
+            if not items: break
+            placed = False
+            for d0 in range(self.max_d0):
+                slots = [(h1 + d0*h2) % self.size for _, h1, h2 in items]
+                if len(set(slots)) < len(slots): continue
+                # Choose d1 so that the first key gets a random free slot
+                for _ in range(self.n_d1_tries):
+                    d1 = (free[int(uniform()*len(free))] - slots[0]) % \
+                         self.size
+                    if not any(used[(s + d1) % self.size] for s in slots[1:]):
+                        placed = True
+                        break
+                if placed: break
+            if not placed: return False
+
+            self.displacements[2*bucket] = d0
+            self.displacements[2*bucket + 1] = d1
+            for (key, _, _), s in zip(items, slots):
+                s = (s + d1) % self.size
+                self.keys[s] = key
+                take(s)
+        return True
+
+    def c_lookup(self, c_key, c_displacements):
+        """C expression for the slot of c_key"""
+        return 'perfect_hash(%s, 0x%xULL, 0x%x, 0x%x, %s)' % (
+                c_key, self.seed, self.n_buckets, self.size, c_displacements)
@@ -9,5 +9,6 @@ time ./suc train suc-data/suc-blogs.tab suc-data/suc-dev.tab \
 python3 build_suc_ne.py --python --n-train-fields 4
 time ./suc_ne train suc-data/suc-blogs-ne-train.tab suc-data/suc-ne-dev.tab \
     swe-pipeline/suc-ne.bin
-tar cvzf swe-pipeline.tar.gz swe-pipeline pysuc.c pysuc_ne.c --owner=0 --group=0
+tar cvzf swe-pipeline.tar.gz swe-pipeline pysuc.c pysuc_ne.c \
+    suc-*.lexicon* suc_ne-*.lexicon* --owner=0 --group=0
 
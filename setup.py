@@ -6,7 +6,7 @@ fasthash = Extension(
     name='fasthash',
     sources=['fasthash.c'],
     libraries=[],
-    extra_compile_args=['-Wall'],
+    extra_compile_args=['-Wall', '-Wno-unused-function'],
     extra_link_args=[],
 )
 
@@ -11,12 +11,20 @@ import shutil
 import sys
 import tempfile
 import re
-from subprocess import Popen
+from contextlib import ExitStack
+import shlex
 import gzip
+import collections
+import functools
+import io
+import itertools
+import multiprocessing
 
 from commandline import create_parser, validate_options
+from compression import CompressedFile, SUFFIXES as COMPRESSION_SUFFIXES
 from conll import tagged_to_tagged_conll
 from lemmatize import SUCLemmatizer
+from parsing import ParserProcess
 from tagger import SucTagger, SucNETagger, UDTagger
 from tokenizer import build_sentences
 
@@ -30,13 +38,24 @@ SCRIPT_DIR = os.path.abspath(os.path.dirname(__file__))
 
 MAX_TOKEN = 256
 
+# Number of characters read from input files at a time
+CHUNK_SIZE = 1 << 20
+
+# Size of the buffers of output files
+OUTPUT_BUFFER_SIZE = 1 << 20
+
+# With --jobs, files of at least this many bytes are divided between the
+# workers in chunks of SENTENCES_PER_CHUNK sentences
+SPLIT_FILE_SIZE = 1 << 24
+SENTENCES_PER_CHUNK = 1000
+
 def main():
     parser = create_parser()
     options, args = parser.parse_args()
     validate_options(options, args)
     run_pipeline(options, args)
 
-def run_pipeline(options, args):
+def load_models(options):
     models = {
         "suc_ne_tagger": None,
         "suc_tagger": None,
@@ -52,57 +71,237 @@ def run_pipeline(options, args):
     if options.ner:
         models["suc_ne_tagger"] = SucNETagger(options.ner_model)
 
+    if options.lemmatized:
+        models["lemmatizer"] = SUCLemmatizer()
+        models["lemmatizer"].load(options.lemmatization_model)
+
+    return models
+
+def run_pipeline(options, args):
+    models = load_models(options)
+
     # Set up the working directory
     tmp_dir = tempfile.mkdtemp("-stb-pipeline")
-    if options.parsed:
+    if options.parsed and not options.parser_command:
         shutil.copy(
             os.path.join(SCRIPT_DIR, options.parsing_model + ".mco"),
             tmp_dir
         )
 
-    if options.lemmatized:
-        models["lemmatizer"] = SUCLemmatizer()
-        models["lemmatizer"].load(options.lemmatization_model)
+    non_capitalized = True if options.non_capitalized else None
+    with ExitStack() as stack:
+        # The workers are forked before the parser is started, so that they
+        # do not inherit its pipes or the thread which reads its output
+        pool = None
+        if options.jobs > 1:
+            pool = stack.enter_context(
+                start_workers(options, tmp_dir, models, non_capitalized))
+
+        parser = start_parser(options, tmp_dir) if options.parsed else None
 
-    # Process each input file
+        if pool is not None:
+            run_parallel(
+                options, args, tmp_dir, models, non_capitalized, pool, parser)
+        else:
+            # Process each input file
+            for filename in args:
+                process_file(
+                    options,
+                    filename,
+                    tmp_dir,
+                    models,
+                    non_capitalized,
+                    parser=parser
+                )
+
+    if parser is not None and parser.close():
+        sys.exit("Parsing failed! See log file: %s" % parser.log_filename)
+
+    cleanup(options, tmp_dir)
+
+# The arguments of process_file in worker processes, which get them from the
+# parent process when forked
+_worker_args = None
+
+def start_workers(options, tmp_dir, models, non_capitalized):
+    """Fork options.jobs worker processes, which use the models of this
+    process. Returns a multiprocessing pool.
+    """
+    global _worker_args
+    _worker_args = (options, tmp_dir, models, non_capitalized)
+    return multiprocessing.get_context("fork").Pool(options.jobs)
+
+def run_parallel(options, args, tmp_dir, models, non_capitalized, pool,
+                 parser):
+    """Process the files in args with the worker processes in pool.
+
+    The workers are forked after the models have been loaded, so that they
+    share the memory of the parent. Each file is processed by one worker,
+    except files of at least SPLIT_FILE_SIZE bytes which are split into
+    chunks of sentences that are annotated by all workers. The parser is
+    only used by the parent process.
+    """
+    small_files = []
+    large_files = []
     for filename in args:
+        if os.path.getsize(filename) >= SPLIT_FILE_SIZE:
+            large_files.append(filename)
+        else:
+            small_files.append(filename)
+
+    for filename, tagged_conll, error in pool.imap_unordered(
+            process_file_worker, small_files):
+        if error is not None:
+            sys.exit(error)
+        if parser is not None:
+            with parse(parser, filename, options.output_dir,
+                       options.compress) as parser_input:
+                parser_input.write(tagged_conll)
+    for filename in large_files:
         process_file(
             options,
             filename,
             tmp_dir,
             models,
-            (True if options.non_capitalized else None)
+            non_capitalized,
+            pool,
+            parser
         )
 
-    cleanup(options, tmp_dir)
+def process_file_worker(filename):
+    # sys.exit() would kill the worker without telling the parent
+    try:
+        options, tmp_dir, models, non_capitalized = _worker_args
+        tagged_conll = process_file(
+            options, filename, tmp_dir, models, non_capitalized)
+    except SystemExit as e:
+        return filename, None, str(e.code)
+    return filename, tagged_conll, None
+
+def annotate_chunk_worker(sentences):
+    options, _, models, _ = _worker_args
+    return annotate_sentences(options, sentences, models)
+
+def annotate_texts_worker(texts):
+    options, _, models, non_capitalized = _worker_args
+    return [
+        annotate_sentences(
+            options,
+            tokenize_input(options, io.StringIO(text), non_capitalized),
+            models
+        )
+        for text in texts
+    ]
 
-def process_file(options, filename, tmp_dir, models, non_capitalized=None):
+def process_file(options, filename, tmp_dir, models, non_capitalized=None,
+                 pool=None, parser=None):
+    """Tokenize and annotate a file, and write the requested outputs to the
+    output directory. If a multiprocessing pool is given, its workers
+    annotate the sentences. The file is parsed if a parser is given,
+    otherwise its input to the parser is returned as a string (for small
+    files processed by worker processes, which can not use the parser).
+    """
     print("Processing %s..." % filename, file=sys.stderr)
 
-    tokenized_filename = output_filename(tmp_dir, filename, "tok")
-    tagged_filename = output_filename(tmp_dir, filename, "tag")
-    ner_filename = output_filename(tmp_dir, filename, "ne")
+    # The outputs are written to temporary files next to them, which are
+    # renamed when complete
+    outputs = [
+        compressed_filename(
+            output_filename(options.output_dir, filename, suffix),
+            options.compress
+        )
+        if requested else None
+        for requested, suffix in (
+            (options.tokenized, "tok"),
+            (options.tagged, "tag"),
+            (options.ner, "ne"),
+        )
+    ]
+    temp_filenames = [
+        name if name is None else temp_filename(name)
+        for name in outputs
+    ]
 
     sentences = run_tokenization(options, filename,
             non_capitalized=non_capitalized)
-    annotated_sentences = []
 
-    with open(tokenized_filename, "w", encoding="utf-8") as tokenized, \
-            open(tagged_filename, "w", encoding="utf-8") as tagged, \
-            open(ner_filename, "w", encoding="utf-8") as ner:
+    try:
+        with ExitStack() as stack:
+            files = [
+                None if name is None else
+                stack.enter_context(open_output(name, options.compress))
+                for name in temp_filenames
+            ]
+            # The sentences are sent to the parser as we go, instead of
+            # keeping all annotated sentences until the parser is run
+            parser_input = None
+            if options.parsed:
+                parser_input = io.StringIO() if parser is None else \
+                    stack.enter_context(parse(
+                        parser, filename, options.output_dir,
+                        options.compress))
+            files.append(parser_input)
+
+            if pool is None:
+                texts_list = (
+                    annotate_sentences(options, [sentence], models)
+                    for sentence in sentences
+                )
+            else:
+                texts_list = map_ordered(
+                    pool,
+                    annotate_chunk_worker,
+                    split_chunks(sentences, SENTENCES_PER_CHUNK),
+                    2*options.jobs
+                )
+
+            for texts in texts_list:
+                for file, text in zip(files, texts):
+                    if file is not None and text:
+                        file.write(text)
+    except BaseException:
+        for name in temp_filenames:
+            if name is not None and os.path.exists(name):
+                os.remove(name)
+        raise
+
+    write_to_output([
+        (name, temp_name)
+        for name, temp_name in zip(outputs, temp_filenames)
+        if name is not None
+    ])
+
+    print("done.", file=sys.stderr)
+
+    if parser is None and parser_input is not None:
+        return parser_input.getvalue()
+
+def annotate_sentences(options, sentences, models):
+    """Annotate a list of sentences.
+
+    Returns the tokenized, tagged and named entity output, as well as the
+    input to the parser, as strings. Outputs which are not requested by the
+    options are empty.
+    """
+    tokenized, tagged, ner, tagged_conll = \
+        io.StringIO(), io.StringIO(), io.StringIO(), io.StringIO()
 
-        # Run only one pass over sentences for writing to both files
-        for sentence in sentences:
+    # Run only one pass over sentences for writing to all files
+    for sentence in sentences:
+        if options.tokenized:
             write_to_file(tokenized, sentence)
 
-            if options.tagged or options.parsed or options.ner:
-                lemmas, ud_tags_list, suc_tags_list, suc_ne_list = \
-                    run_tagging_and_lemmatization(options, sentence, models)
+        if options.tagged or options.parsed or options.ner:
+            lemmas, ud_tags_list, suc_tags_list, suc_ne_list = \
+                run_tagging_and_lemmatization(options, sentence, models)
 
-                annotated_sentences.append(
-                    zip(sentence, lemmas, ud_tags_list, suc_tags_list)
+            if options.parsed:
+                tagged_to_tagged_conll(
+                    [zip(sentence, lemmas, ud_tags_list, suc_tags_list)],
+                    tagged_conll
                 )
 
+            if options.tagged:
                 ud_tag_list = [
                     ud_tags[:ud_tags.find("|")]
                     for ud_tags in ud_tags_list
@@ -117,58 +316,125 @@ def process_file(options, filename, tmp_dir, models, non_capitalized=None):
 
                 write_to_file(tagged, lines)
 
-                if options.ner:
-                    ner_lines = [
-                        "\t".join(line)
-                        for line in zip(sentence, suc_ne_list)
-                    ]
-
-                    write_to_file(ner, ner_lines)
-
-    parsed_filename = ""
-    if options.parsed:
-        parsed_filename = parse(
-            options, filename, annotated_sentences, tmp_dir
-        )
-
-    write_to_output([
-        (options.tokenized, tokenized_filename, options.output_dir),
-        (options.tagged, tagged_filename, options.output_dir),
-        (options.parsed, parsed_filename, options.output_dir),
-        (options.ner, ner_filename, options.output_dir),
-    ])
+            if options.ner:
+                ner_lines = [
+                    "\t".join(line)
+                    for line in zip(sentence, suc_ne_list)
+                ]
 
-    print("done.", file=sys.stderr)
+                write_to_file(ner, ner_lines)
+
+    return (tokenized.getvalue(), tagged.getvalue(), ner.getvalue(),
+            tagged_conll.getvalue())
+
+def split_chunks(items, size):
+    """Generate lists of size items (the last one may be shorter)"""
+    items = iter(items)
+    while True:
+        chunk = list(itertools.islice(items, size))
+        if not chunk:
+            break
+        yield chunk
+
+def map_ordered(pool, function, items, max_pending):
+    """Like pool.imap(function, items), but without reading more than
+    max_pending items ahead of the results that have been consumed.
+    """
+    pending = collections.deque()
+    for item in items:
+        pending.append(pool.apply_async(function, (item,)))
+        if len(pending) >= max_pending:
+            yield pending.popleft().get()
+    while pending:
+        yield pending.popleft().get()
 
 def run_tokenization(options, filename, non_capitalized=None):
-    with (gzip.open(filename, "rt", encoding="utf-8")
-            if filename.endswith(".gz")
-            else open(filename, "r", encoding="utf-8")) as input_file:
-        data = input_file.read()
-
-        if options.skip_tokenization:
-            sentences = [
-                sentence.split('\n')
-                for sentence in data.split('\n\n')
-                if sentence.strip()
-            ]
-        elif options.skip_segmentation:
-            sentences = [
-                    build_sentences(line, segment=False)
-                    for line in data.split('\n')
-                    if line.strip()
-            ]
+    """Generate the sentences of a file, as lists of tokens.
+
+    The file is read CHUNK_SIZE characters at a time, so memory use does not
+    depend on the size of the file.
+    """
+    with open_input(filename) as input_file:
+        yield from tokenize_input(options, input_file, non_capitalized)
+
+def tokenize_input(options, input_file, non_capitalized=None):
+    if options.skip_tokenization:
+        sentences = (
+            sentence.split('\n')
+            for sentence in read_blocks(input_file, '\n\n')
+            if sentence.strip()
+        )
+    elif options.skip_segmentation:
+        sentences = (
+            build_sentences(line, segment=False)
+            for line in read_blocks(input_file, '\n')
+            if line.strip()
+        )
+    else:
+        sentences = tokenize_chunks(read_chunks(input_file), non_capitalized)
+
+    for sentence in sentences:
+        sentence = [token for token in sentence if len(token) <= MAX_TOKEN]
+        if sentence:
+            yield sentence
+
+def tokenize_chunks(chunks, non_capitalized=None):
+    for chunk in chunks:
+        # Guess from the first chunk whether the text is capitalized
+        if non_capitalized is None:
+            n_capitalized = len(re.findall(r'[\.!?] +[A-ZÅÄÖ]', chunk))
+            n_non_capitalized = len(re.findall(r'[\.!?] +[a-zåäö]', chunk))
+            non_capitalized = n_non_capitalized > 5*n_capitalized
+        yield from build_sentences(chunk, non_capitalized=non_capitalized)
+
+def open_input(filename):
+    if filename.endswith(".gz"):
+        return gzip.open(filename, "rt", encoding="utf-8")
+    return open(filename, "r", encoding="utf-8")
+
+def read_blocks(input_file, separator, chunk_size=CHUNK_SIZE):
+    """Generate the same strings as input_file.read().split(separator)"""
+    rest = ""
+    while True:
+        data = input_file.read(chunk_size)
+        if not data:
+            break
+        blocks = (rest + data).split(separator)
+        rest = blocks.pop()
+        yield from blocks
+    yield rest
+
+def read_chunks(input_file, chunk_size=CHUNK_SIZE):
+    """Read a file in chunks of at least chunk_size characters which end at
+    paragraph breaks, so that they can be tokenized independently.
+
+    Paragraphs are never split, since the tokenizer could segment sentences
+    differently at any other place, so a long paragraph is read as a whole.
+    """
+    parts = []
+    length = 0
+    while True:
+        data = input_file.read(chunk_size)
+        if not data:
+            break
+        # The tokenizer always ends sentences at paragraph breaks. Only the
+        # new data is searched (from the last character read before), and
+        # the parts read since the last chunk are joined when one is found,
+        # so that a long paragraph is not copied once per read.
+        prev = parts[-1][-1:] if parts else ""
+        end = (prev + data).rfind('\n\n')
+        # The rest of the previous chunk starts with a paragraph break
+        if end >= 0 and length - len(prev) + end > 0:
+            text = "".join(parts) + data
+            end += length - len(prev)
+            yield text[:end]
+            parts = [text[end:]]
+            length = len(parts[0])
         else:
-            if non_capitalized is None:
-                n_capitalized = len(re.findall(r'[\.!?] +[A-ZÅÄÖ]', data))
-                n_non_capitalized = len(re.findall(r'[\.!?] +[a-zåäö]', data))
-                non_capitalized = n_non_capitalized > 5*n_capitalized
-            sentences = build_sentences(data, non_capitalized=non_capitalized)
-
-    sentences = list(filter(bool,
-        [[token for token in sentence if len(token) <= MAX_TOKEN]
-            for sentence in sentences]))
-    return sentences
+            parts.append(data)
+            length += len(data)
+    if length:
+        yield "".join(parts)
 
 def run_tagging_and_lemmatization(options, sentence, models):
     lemmas = []
@@ -190,49 +456,62 @@ def run_tagging_and_lemmatization(options, sentence, models):
 
     return lemmas, ud_tags_list, suc_tags_list, suc_ne_list
 
-def parse(options, filename, annotated_sentences, tmp_dir):
-    tagged_conll_filename = output_filename(tmp_dir, filename, "tag.conll")
-    parsed_filename = output_filename(tmp_dir, filename, "conll")
-    log_filename = output_filename(tmp_dir, filename, "log")
-
-    # The parser command line is dependent on the input and
-    # output files, so we build that one for each data file
-    parser_cmdline = [
-        "java",
-        "-Xmx2000m",
-        "-jar", os.path.expanduser(options.malt),
-        "-m", "parse",
-        "-i", tagged_conll_filename,
-        "-o", parsed_filename,
-        "-w", tmp_dir,
-        "-c", os.path.basename(options.parsing_model)
-    ]
-
-    # Conversion from .tag file to tagged.conll (input format for the parser)
-    tagged_conll_file = open(tagged_conll_filename, "w", encoding="utf-8")
-    tagged_to_tagged_conll(annotated_sentences, tagged_conll_file)
-    tagged_conll_file.close()
-
-    # Run the parser
-    with open(log_filename, "w", encoding="utf-8") as log_file:
-        returncode = Popen(
-            parser_cmdline, stdout=log_file, stderr=log_file
-        ).wait()
-
-    if returncode:
-        sys.exit("Parsing failed! See log file: %s" % log_filename)
-
-    return parsed_filename
+def start_parser(options, tmp_dir):
+    log_filename = os.path.join(tmp_dir, "parser.log")
+    if options.parser_command:
+        parser_cmdline = shlex.split(options.parser_command)
+    else:
+        # MaltParser reads from stdin and writes to stdout by default, but
+        # also logs to stdout unless it is given a log file
+        parser_cmdline = [
+            "java",
+            "-Xmx2000m",
+            "-jar", os.path.expanduser(options.malt),
+            "-m", "parse",
+            "-w", tmp_dir,
+            "-c", os.path.basename(options.parsing_model),
+            "-lfi", log_filename
+        ]
+    return ParserProcess(
+        parser_cmdline,
+        log_filename,
+        functools.partial(open_output, compression=options.compress)
+    )
+
+def parse(parser, filename, output_dir, compression=None):
+    """Start parsing a file. Returns a file-like object to which the input to
+    the parser is written, see ParserProcess.open(). The parsed sentences are
+    written to output_dir by the parser in the background.
+    """
+    parsed_filename = compressed_filename(
+        output_filename(output_dir, filename, "conll"), compression)
+    return parser.open(parsed_filename, temp_filename(parsed_filename))
 
 def write_to_file(file, lines):
     for line in lines:
         print(line, file=file)
     print(file=file)
 
+def open_output(filename, compression=None):
+    """Open an output file for writing text, which is compressed if
+    compression is one of the methods in compression.SUFFIXES.
+    """
+    if compression in COMPRESSION_SUFFIXES:
+        return CompressedFile(filename, compression, OUTPUT_BUFFER_SIZE)
+    return open(filename, "w", encoding="utf-8", buffering=OUTPUT_BUFFER_SIZE)
+
+def compressed_filename(filename, compression):
+    return filename + COMPRESSION_SUFFIXES.get(compression, "")
+
+def temp_filename(filename):
+    """Name of a temporary file to write instead of filename"""
+    directory, basename = os.path.split(filename)
+    return os.path.join(directory, ".%s.%d.tmp" % (basename, os.getpid()))
+
 def write_to_output(filename_mapping):
-    for should_copy, filename, output_dir in filename_mapping:
-        if should_copy:
-            shutil.copy(filename, output_dir)
+    """Rename complete temporary files to their final names"""
+    for filename, temp_name in filename_mapping:
+        os.replace(temp_name, filename)
 
 def cleanup(options, tmp_dir):
     if not options.no_delete:
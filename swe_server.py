@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+"""Annotate Swedish text sent over HTTP, with the models loaded only once.
+
+The server takes the same options as swe_pipeline.py, except for the output
+directory, the input files, --parsed and --all:
+
+    ./swe_server.py --port 8000 --tokenized --tagged --lemmatized --ner
+
+Text is annotated by POSTing it in UTF-8:
+
+    curl --data-binary @file.txt http://localhost:8000/
+
+The response is a JSON object with the requested outputs ("tok", "tag" and
+"ne"), in the same formats as the files written by swe_pipeline.py.
+Requests are annotated by --jobs worker processes, and requests which wait
+for a worker are annotated together.
+"""
+
+import json
+import queue
+import sys
+import threading
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from commandline import create_parser, validate_models, ERROR_MESSAGES
+from swe_pipeline import load_models, start_workers, annotate_texts_worker
+
+# Maximum number of characters in a batch of requests
+BATCH_SIZE = 1 << 20
+
+def main():
+    parser = create_server_parser()
+    options, args = parser.parse_args()
+    if args:
+        parser.error("the server does not take any input files")
+    validate_server_options(options)
+    server = AnnotationServer(options)
+    print("Listening on %s:%d" % server.server_address[:2], file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+def create_server_parser():
+    parser = create_parser()
+    parser.set_usage("usage: %prog [options]")
+    parser.add_option("--host", dest="host", default="localhost",
+                  help="Address to listen on (default: %default)")
+    parser.add_option("--port", dest="port", type="int", default=8000,
+                  help="Port to listen on (default: %default)")
+    return parser
+
+def validate_server_options(options):
+    # --all would include parsing
+    if options.all:
+        sys.exit(ERROR_MESSAGES.all_in_server)
+
+    if options.parsed:
+        sys.exit(ERROR_MESSAGES.parsed_in_server)
+
+    if not (options.tokenized or options.tagged or options.ner):
+        sys.exit(ERROR_MESSAGES.no_action)
+
+    if options.jobs < 1:
+        sys.exit(ERROR_MESSAGES.invalid_jobs)
+
+    validate_models(options)
+
+class Batcher:
+    """Sends the texts of requests to the workers in batches.
+
+    At most max_pending batches are given to the workers at a time, so that
+    requests which arrive while the workers are busy are collected into
+    larger batches.
+    """
+    def __init__(self, pool, max_pending):
+        self.pool = pool
+        self.pending = threading.BoundedSemaphore(max_pending)
+        self.requests = queue.Queue()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def annotate(self, text):
+        """Return the output of annotate_sentences() for text"""
+        future = Future()
+        self.requests.put((text, future))
+        return future.result()
+
+    def _run(self):
+        while True:
+            self.pending.acquire()
+            batch = [self.requests.get()]
+            size = len(batch[0][0])
+            while size < BATCH_SIZE:
+                try:
+                    batch.append(self.requests.get_nowait())
+                except queue.Empty:
+                    break
+                size += len(batch[-1][0])
+            self._submit(batch)
+
+    def _submit(self, batch):
+        futures = [future for _, future in batch]
+
+        def done(results):
+            self.pending.release()
+            for future, result in zip(futures, results):
+                future.set_result(result)
+
+        def failed(error):
+            self.pending.release()
+            for future in futures:
+                future.set_exception(error)
+
+        self.pool.apply_async(
+            annotate_texts_worker,
+            ([text for text, _ in batch],),
+            callback=done,
+            error_callback=failed
+        )
+
+class AnnotationServer(ThreadingHTTPServer):
+    # Many clients may connect at the same time, while the annotation keeps
+    # the server busy
+    request_queue_size = 128
+
+    def __init__(self, options):
+        models = load_models(options)
+        non_capitalized = True if options.non_capitalized else None
+        # The workers must be forked before any threads are started
+        self.pool = start_workers(options, None, models, non_capitalized)
+        self.batcher = Batcher(self.pool, 2*options.jobs)
+        # The outputs of annotate_sentences() which should be returned
+        self.outputs = [
+            (name, i)
+            for i, (name, requested) in enumerate([
+                ("tok", options.tokenized),
+                ("tag", options.tagged),
+                ("ne", options.ner)])
+            if requested
+        ]
+        super().__init__((options.host, options.port), AnnotationHandler)
+
+    def server_close(self):
+        super().server_close()
+        self.pool.terminate()
+
+class AnnotationHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        length = self.headers.get("Content-Length")
+        if length is None:
+            self.send_error(411)
+            return
+        try:
+            length = int(length)
+        except ValueError:
+            length = -1
+        if length < 0:
+            self.send_error(400, "Invalid Content-Length")
+            return
+
+        try:
+            text = self.rfile.read(length).decode("utf-8")
+        except UnicodeDecodeError:
+            self.send_error(400, "The text must be encoded in UTF-8")
+            return
+
+        try:
+            outputs = self.server.batcher.annotate(text)
+        except Exception as e:
+            self.send_error(500, str(e))
+            return
+
+        body = json.dumps(
+            {name: outputs[i] for name, i in self.server.outputs},
+            ensure_ascii=False
+        ).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+if __name__ == '__main__':
+    main()
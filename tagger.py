@@ -2,29 +2,47 @@ import udt_suc_sv
 import suc
 import suc_ne
 import collections
+import mmap
+import os
+
+def load_weights(filename):
+    """Map a model file into memory.
+
+    The pages of the file are shared between all processes using the same
+    model, e.g. multiple pipeline workers.
+    """
+    with open(filename, 'rb') as f:
+        # mmap can not map empty files
+        if os.fstat(f.fileno()).st_size == 0:
+            return b''
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
 
 # Tags a sentence with SUC tags based on a trained model
 class SucTagger():
 
     def __init__(self, tagging_model):
-        with open(tagging_model, 'rb') as f:
-            self.tagger_weights = f.read()
+        self.tagger = suc.Tagger(load_weights(tagging_model))
 
     def tag(self, sentence):
-        tags_list = suc.tag(self.tagger_weights, sentence)
+        tags_list = self.tagger.tag(sentence)
         return tags_list
 
+    def tag_batch(self, sentences):
+        return self.tagger.tag_batch(sentences)
+
 # Tags a sentence with SUC-style named entity tags based on a trained model
 class SucNETagger():
 
     def __init__(self, tagging_model):
-        with open(tagging_model, 'rb') as f:
-            self.tagger_weights = f.read()
+        self.tagger = suc_ne.Tagger(load_weights(tagging_model))
 
     def tag(self, sentence):
-        tags_list = suc_ne.tag(self.tagger_weights, sentence)
+        tags_list = self.tagger.tag(sentence)
         return tags_list
 
+    def tag_batch(self, sentences):
+        return self.tagger.tag_batch(sentences)
+
 
 # Tags a sentence with UD tags based on a model trained on SUC tags
 class UDTagger():
@@ -86,8 +104,7 @@ class UDTagger():
     #}
 
     def __init__(self, tagging_model):
-        with open(tagging_model, 'rb') as f:
-            self.tagger_weights = f.read()
+        self.tagger = udt_suc_sv.Tagger(load_weights(tagging_model))
 
     def _is_nonstring_iterable(self, value):
         if not isinstance(value, collections.Iterable) or isinstance(value, str):
@@ -100,7 +117,7 @@ class UDTagger():
 
         suc_sentence = [(lemma, tag.split('|',1)[0], tag)
                         for lemma, tag in zip(lemmas, suc_tags_list)]
-        tag_list = udt_suc_sv.tag(self.tagger_weights, suc_sentence)
+        tag_list = self.tagger.tag(suc_sentence)
         tag_list = self.ud_verb_heuristics(tag_list, sentence, lemmas)
         features = self.ud_features(suc_tags_list, lemmas)
         return tuple(["|".join(t) for t in zip(tag_list, features)])
@@ -1,23 +1,28 @@
 from operator import itemgetter
+from array import array
 from math import ceil, log2
 
 import fasthash
+from perfecthash import PerfectHash
 
 def hash32trans(s):
-    return fasthash.hashlongs32(tuple(ord(c) for c in s))
+    return fasthash.hashstr32(s)
 
 def hash64trans(s):
-    return fasthash.hashlongs64(tuple(ord(c) for c in s))
+    return fasthash.hashstr64(s)
 
 class TagLexicon:
     def __init__(self, name, field, n_items, open_tags, config):
         config.lexicon = self
 
         self.field = field
-        size = 1 << (ceil(log2(n_items) + 0.5))
+        size = 1 << (ceil(log2(max(1, n_items)) + 0.5))
         self.table = [None] * size
         self.fun = hash32trans if config.lexicon_hash_bits == 32 \
                    else hash64trans
+        self.fun_many = fasthash.hashstr32_many \
+                        if config.lexicon_hash_bits == 32 \
+                        else fasthash.hashstr64_many
         self.name = name
         self.value_idx = {}
         self.config = config
@@ -27,49 +32,96 @@ class TagLexicon:
         self.c_table = name
 
     def __setitem__(self, key, value):
-        i = self.fun(key) % len(self.table)
+        self._insert(key, self.fun(key), value)
+
+    def update(self, items):
+        """Add (key, value) pairs, which is faster than adding them one by
+        one since all keys are hashed at once."""
+        items = list(items)
+        key_hashes = self.fun_many([key for key, _ in items])
+        for (key, value), key_hash in zip(items, key_hashes):
+            self._insert(key, key_hash, value)
+
+    def _insert(self, key, key_hash, value):
+        i = key_hash % len(self.table)
         while not self.table[i] is None:
             if self.table[i][0] == key: return
             #assert self.table[i][0] != key, 'Collision in tag lexicon'
             i = (i + 1) % len(self.table)
         idx = self.value_idx.setdefault(tuple(value), len(self.value_idx))
-        self.table[i] = (key, idx)
+        self.table[i] = (key, key_hash, idx)
 
     def c_emit(self, f):
-        f.write('#define %s 0x%x\n\n' % (
-            self.c_size, len(self.table)))
-        for tags,i in sorted(self.value_idx.items(), key=itemgetter(1)):
-            f.write('static const label %s_tags_%d[] = { %d, %s };\n' % (
-                self.name, i, len(tags), ', '.join(map(str, tags))))
-            
-        f.write('static const label %s_tags_open[] = { %d, %s };\n' % (
-            self.name, len(self.open_tags),
-            ', '.join(map(str, sorted(self.open_tags)))))
-
-        def c_kv(entry):
-            if entry is None: return '{ 0, NULL }'
-            key, idx = entry
-            return '{ 0x%x, %s_tags_%d }' % (self.fun(key), self.name, idx)
-
-        body = '\n'.join(
-                '    %s%s' % (c_kv(t), '' if i == len(self.table)-1 else ',')
-                for i,t in enumerate(self.table))
-
-        f.write('static const hash%d_kv %s[%s] = {\n%s\n};\n\n' % (
-            self.config.lexicon_hash_bits, self.c_table, self.c_size, body))
-
-        f.write('''
+        # The tag lists, each starting with its length, the list of open
+        # tags (returned for unknown keys) first. The table values are
+        # offsets into this array.
+        tags = array('I', [len(self.open_tags)] + sorted(self.open_tags))
+        offsets = {}
+        for value,i in sorted(self.value_idx.items(), key=itemgetter(1)):
+            offsets[i] = len(tags)
+            tags.extend([len(value)] + list(value))
+
+        hash_type = 'I' if self.config.lexicon_hash_bits == 32 else 'Q'
+        key_hashes = [None if entry is None else entry[1]
+                      for entry in self.table]
+
+        entries = {}
+        if self.config.perfect_hash:
+            # Keys with the same hash get the value that linear probing
+            # would find first.
+            for i, (entry, h) in enumerate(zip(self.table, key_hashes)):
+                if entry is None: continue
+                distance = (i - h) % len(self.table)
+                if h not in entries or distance < entries[h][0]:
+                    entries[h] = (distance, offsets[entry[2]])
+        # A perfect hash table for no keys would have no free slot for
+        # missing keys, so empty lexicons use the plain table.
+        perfect_hash = bool(entries)
+
+        if perfect_hash:
+            table = PerfectHash(list(entries.keys()))
+            hashes = array(hash_type, table.keys)
+            values = array('I', (entries[h][1] for h in table.keys))
+        else:
+            hashes = array(hash_type, (0 if h is None else h
+                                       for h in key_hashes))
+            values = array('I', (0 if entry is None else offsets[entry[2]]
+                                 for entry in self.table))
+
+        f.write('#define %s 0x%x\n\n' % (self.c_size, len(hashes)))
+
+        arrays = [
+            ('uint%d_t' % self.config.lexicon_hash_bits,
+             '%s_hashes' % self.c_table, hashes),
+            ('label', '%s_values' % self.c_table, values),
+            ('label', '%s_tags' % self.c_table, tags)]
+        if perfect_hash:
+            arrays.append(('uint32_t', '%s_displacements' % self.c_table,
+                           table.displacements))
+        self.config.c_emit_data(f, self.name, arrays)
+
+        if perfect_hash:
+            f.write('''
+static inline const label *%s_get_tags(uint%d_t key) {
+    const size_t i = %s;
+    if (%s_hashes[i] == key) return %s_tags + %s_values[i];
+    return %s_tags;
+}
+''' % (self.name, self.config.lexicon_hash_bits,
+       table.c_lookup('key', '%s_displacements' % self.c_table),
+       self.c_table, self.c_table, self.c_table, self.c_table))
+        else:
+            f.write('''
 static inline const label *%s_get_tags(uint%d_t key) {
     size_t i = key & 0x%x;
     for (;;) {
-        if (%s[i].hash == key) return (const label*)%s[i].value;
-        if (%s[i].value == NULL) return %s_tags_open;
+        if (%s_hashes[i] == key) return %s_tags + %s_values[i];
+        if (%s_values[i] == 0) return %s_tags;
         i = (i + 1) & 0x%x;
     }
 }
-
-#define get_tags %s_get_tags
 ''' % (self.name, self.config.lexicon_hash_bits, len(self.table)-1,
-       self.c_table, self.c_table, self.c_table, self.name,
-       len(self.table)-1, self.name))
+       self.c_table, self.c_table, self.c_table, self.c_table, self.c_table,
+       len(self.table)-1))
 
+        f.write('\n#define get_tags %s_get_tags\n' % self.name)
@@ -1,4 +1,4 @@
-import math, itertools
+import math, itertools, hashlib
 
 class Tagset:
     def __init__(self, tags, config):
@@ -44,6 +44,11 @@ static const int %s_from_str(const char *s) {
         if self.subsets:
             f.write(self._subset_table())
 
+    def fingerprint(self):
+        """Hash of the tagset, for checking that model files match it"""
+        return '0x'+hashlib.sha256(
+                '\n'.join(self.tags).encode('utf-8')).hexdigest()[:16]
+
     def register_mapping(self, fun):
         """Register a function mapping tags to some other set"""
         assert not self._frozen
@@ -97,11 +102,15 @@ class Tag:
         self.tagset = tagset
         tagset.tag_fields.add(field)
 
+    def get_position(self):
+        return self.position
+
     def c_value(self):
+        # history points to position i of the tag sequence
         if self.position == 0:
             return 'tag'
         else:
-            return '((i>=%d)? history[i-%d] : %s)' % (
+            return '((i>=%d)? history[-%d] : %s)' % (
                     -self.position, -self.position, self.tagset.c_n_tags)
 
 
@@ -110,7 +119,10 @@ class TransformedTag(Tag):
         self.tagset = tag.tagset
         self.tag = tag
         self.fun = fun
-        
+
+    def get_position(self):
+        return self.tag.get_position()
+
     def c_value(self):
         return '(%s[%s] & 0x%x)' % (
             self.tagset.c_tag_subsets, self.tag.c_value(),
@@ -0,0 +1,24 @@
+#!/usr/bin/env python3
+"""Stand-in for MaltParser, which attaches each token to the previous one.
+
+Reads tagged CoNLL sentences from stdin and writes them to stdout with a
+head and a dependency relation added to each token. Like MaltParser, it
+buffers its output. With --fail, it exits after the first sentence.
+"""
+
+import sys
+
+def main():
+    fail = "--fail" in sys.argv[1:]
+    for line in sys.stdin:
+        fields = line.rstrip("\n").split("\t")
+        if len(fields) < 2:
+            print()
+            if fail:
+                sys.exit(1)
+            continue
+        head = int(fields[0]) - 1
+        print("\t".join(fields + [str(head), "root" if head < 0 else "dep"]))
+
+if __name__ == '__main__':
+    main()
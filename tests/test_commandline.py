@@ -39,6 +39,16 @@ class TestCommandlineFailiures(unittest.TestCase):
 
         self.assertEqual(str(manager.exception), ERROR_MESSAGES.no_filename)
 
+    def test_invalid_jobs(self):
+        with self.assertRaises(SystemExit) as manager:
+            _validate_args(["--tokenized", "--output=DIR", "--jobs=0", "out.txt"])
+
+        self.assertEqual(str(manager.exception), ERROR_MESSAGES.invalid_jobs)
+
+    def test_invalid_compression(self):
+        with self.assertRaises(SystemExit):
+            _validate_args(["--tokenized", "--output=DIR", "--compress=zip", "out.txt"])
+
     def test_incorrect_tagging_model(self):
         with self.assertRaises(SystemExit) as manager:
             _validate_args(["--tagged", "--output=DIR", "--tagging-model=MODEL", "out.txt"])
@@ -0,0 +1,65 @@
+import gzip
+import os
+import tempfile
+import unittest
+import compression
+from compression import CompressedFile
+
+def decompress(method, data):
+    if method == "gzip":
+        return gzip.decompress(data)
+    elif method == "zstd":
+        import zstandard
+        return zstandard.ZstdDecompressor().decompressobj().decompress(data)
+    elif method == "lz4":
+        import lz4.frame
+        return lz4.frame.decompress(data)
+
+class TestCompressedFile(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.tmp_dir.name, "file")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def assertRoundTrip(self, method, texts, buffer_size):
+        with CompressedFile(self.filename, method, buffer_size) as f:
+            for text in texts:
+                f.write(text)
+        with open(self.filename, "rb") as f:
+            data = decompress(method, f.read())
+        self.assertEqual(data.decode("utf-8"), "".join(texts))
+
+    def assertMethod(self, method):
+        texts = ["Hej\tIN\nmitt\tPS|NEU|SIN|DEF\n\n", "Åäö\n" * 1000, ""]
+        for buffer_size in (1, 100, 1 << 20):
+            self.assertRoundTrip(method, texts, buffer_size)
+            self.assertRoundTrip(method, [], buffer_size)
+
+    def test_gzip(self):
+        self.assertMethod("gzip")
+
+    @unittest.skipUnless(compression.is_available("zstd"), "needs zstandard")
+    def test_zstd(self):
+        self.assertMethod("zstd")
+
+    @unittest.skipUnless(compression.is_available("lz4"), "needs lz4")
+    def test_lz4(self):
+        self.assertMethod("lz4")
+
+    def test_write_error(self):
+        f = CompressedFile(self.filename, "gzip", 1)
+        f.file.close()
+        with self.assertRaises(ValueError):
+            f.write("Hej\n")
+            f.close()
+
+    def test_close_after_error(self):
+        f = CompressedFile(self.filename, "gzip")
+        f.write("Hej\n")
+        f.error = ValueError("Write failed")
+        with self.assertRaises(ValueError):
+            f.close()
+        self.assertFalse(f.thread.is_alive())
+        self.assertTrue(f.file.closed)
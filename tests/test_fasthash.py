@@ -0,0 +1,55 @@
+import unittest
+import fasthash
+
+WORDS = ['Hus', '', 'åäö', '€uro', '😀', 'x' * 300, '€' * 300, '😀' * 300]
+
+class TestFasthash(unittest.TestCase):
+    def test_hashstr(self):
+        for word in WORDS:
+            code_points = tuple(ord(c) for c in word)
+            self.assertEqual(fasthash.hashstr32(word),
+                             fasthash.hashlongs32(code_points))
+            self.assertEqual(fasthash.hashstr64(word),
+                             fasthash.hashlongs64(code_points))
+
+    def test_hashstr_long(self):
+        # Longer than would fit on the stack
+        for word in ['x' * 20000000, '€' * 20000000]:
+            self.assertEqual(fasthash.hashstr32_many([word])[0],
+                             fasthash.hashstr32(word))
+            self.assertEqual(fasthash.hashstr64_many([word])[0],
+                             fasthash.hashstr64(word))
+
+    def test_hashstr_many(self):
+        hashes = fasthash.hashstr32_many(WORDS)
+        self.assertEqual(hashes.typecode, 'I')
+        self.assertEqual(list(hashes),
+                         [fasthash.hashstr32(word) for word in WORDS])
+        hashes = fasthash.hashstr64_many(tuple(WORDS))
+        self.assertEqual(hashes.typecode, 'Q')
+        self.assertEqual(list(hashes),
+                         [fasthash.hashstr64(word) for word in WORDS])
+
+    def test_hash_many(self):
+        self.assertEqual(list(fasthash.hash32_many(1, WORDS)),
+                         [fasthash.hash32(1, word.encode('utf-8'))
+                          for word in WORDS])
+        self.assertEqual(list(fasthash.hash64_many(1, WORDS)),
+                         [fasthash.hash64(1, word.encode('utf-8'))
+                          for word in WORDS])
+        self.assertEqual(list(fasthash.hash32_many(2, [b'ab', 'ab'])),
+                         [fasthash.hash32(2, b'ab')] * 2)
+
+    def test_empty(self):
+        self.assertEqual(len(fasthash.hashstr32_many([])), 0)
+        self.assertEqual(len(fasthash.hash64_many(1, [])), 0)
+
+    def test_type_errors(self):
+        with self.assertRaises(TypeError):
+            fasthash.hashstr32(b'bytes')
+        with self.assertRaises(TypeError):
+            fasthash.hashstr32_many(['word', 1])
+        with self.assertRaises(TypeError):
+            fasthash.hash32_many(1, ['word', 1])
+        with self.assertRaises(TypeError):
+            fasthash.hash32_many(1, 1)
@@ -0,0 +1,30 @@
+import random
+import unittest
+from perfecthash import PerfectHash, fmix64
+
+class TestPerfectHash(unittest.TestCase):
+    def assertPerfect(self, keys):
+        table = PerfectHash(keys)
+        self.assertEqual(table.size, max(1, len(keys)))
+        slots = [table.slot(key) for key in keys]
+        self.assertEqual(sorted(slots), list(range(len(keys))))
+        for key, slot in zip(keys, slots):
+            self.assertEqual(table.keys[slot], key)
+
+    def test_32_bit_keys(self):
+        rng = random.Random(1)
+        self.assertPerfect(list({rng.getrandbits(32) for _ in range(5000)}))
+
+    def test_64_bit_keys(self):
+        rng = random.Random(2)
+        self.assertPerfect(list({rng.getrandbits(64) for _ in range(5000)}))
+
+    def test_small(self):
+        self.assertPerfect([])
+        self.assertPerfect([0])
+        self.assertPerfect([1, 2])
+
+    def test_fmix64(self):
+        # Values of hash64_fmix() in hash.c
+        self.assertEqual(fmix64(0), 0)
+        self.assertEqual(fmix64(1), 0x283a72a5b9ab93d3)
@@ -1,57 +1,118 @@
-from swe_pipeline import parse
+import os
+from parsing import ParserProcess
+from swe_pipeline import parse, start_parser
+import sys
+import tempfile
 import unittest
-from unittest.mock import patch, MagicMock, mock_open
+from unittest.mock import patch, MagicMock
+
+DUMMY_PARSER = os.path.join(os.path.dirname(__file__), "dummy_parser.py")
+
+TAGGED_CONLL = [
+    "0\tHej\thej\tINTJ\tIN\t_\n"
+    "\n",
+    "0\tHej\thej\tINTJ\tIN\t_\n"
+    "1\tSlim\tSlim\tPROPN\tPM|NOM\tCase=Nom\n"
+    "\n",
+]
+
+PARSED_CONLL = [
+    "0\tHej\thej\tINTJ\tIN\t_\t-1\troot\n"
+    "\n",
+    "0\tHej\thej\tINTJ\tIN\t_\t-1\troot\n"
+    "1\tSlim\tSlim\tPROPN\tPM|NOM\tCase=Nom\t0\tdep\n"
+    "\n",
+]
 
 class TestParse(unittest.TestCase):
-    def _default_options(self):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.dir = self.tmp_dir.name
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def _default_options(self, parser_command=None):
         options = MagicMock()
         options.malt = "/dummy/maltparser.jar"
         options.parsing_model = "/dummy/maltmodel.mco"
+        options.parser_command = parser_command
         return options
 
-    @patch("swe_pipeline.tagged_to_tagged_conll")
-    @patch("swe_pipeline.Popen")
-    def test_run_parser(self, popen_mock, *args):
-        options = self._default_options()
+    def _parse(self, parser, filename, sentences):
+        with parse(parser, filename, self.dir) as parser_input:
+            for sentence in sentences:
+                parser_input.write(sentence)
 
-        popen_mock().wait.return_value = 0
-        data = [zip(
-            ["Hej", "mitt", "namn", "är"],
-            ["hej", "min", "namn", "vara"],
-            [
-                "INTJ|_",
-                "DET|Definite=Def|Gender=Neut|Number=Sing|Poss=Yes",
-                "NOUN|Case=Nom|Definite=Ind|Gender=Neut|Number=Sing",
-                "AUX|Mood=Ind|Tense=Pres|VerbForm=Fin|Voice=Act",
-            ],
-            ["IN", "PS|NEU|SIN|DEF", "NN|NEU|SIN|IND|NOM", "VB|PRS|AKT"],
-        )]
-
-        open_mock = mock_open()
-        with patch("swe_pipeline.open", open_mock, create=True):
-            self.assertEqual(
-                parse(options, "file.txt", data, "/tmp"),
-                "/tmp/file.conll"
-            )
-            arguments = popen_mock.call_args_list[1][0][0]
-            self.assertEqual(
-                " ".join(arguments),
-                (
-                    "java -Xmx2000m -jar /dummy/maltparser.jar "
-                    "-m parse -i /tmp/file.tag.conll -o /tmp/file.conll "
-                    "-w /tmp -c maltmodel.mco"
-                )
-            )
+    def _read_output(self, name):
+        with open(os.path.join(self.dir, name + ".conll")) as f:
+            return f.read()
 
-    @patch("swe_pipeline.tagged_to_tagged_conll")
-    @patch("swe_pipeline.Popen")
-    def test_parser_error(self, popen_mock, *args):
+    @patch("parsing.Popen")
+    def test_malt_command(self, popen_mock):
         options = self._default_options()
+        start_parser(options, "/tmp")
+        arguments = popen_mock.call_args_list[0][0][0]
+        self.assertEqual(
+            " ".join(arguments),
+            (
+                "java -Xmx2000m -jar /dummy/maltparser.jar "
+                "-m parse -w /tmp -c maltmodel.mco -lfi /tmp/parser.log"
+            )
+        )
+
+    def test_run_parser(self):
+        options = self._default_options(
+            "%s %s" % (sys.executable, DUMMY_PARSER))
+        parser = start_parser(options, self.dir)
+        self._parse(parser, "/data/file1.txt", TAGGED_CONLL)
+        self._parse(parser, "file2.txt", TAGGED_CONLL[1:])
+        self._parse(parser, "file3", [])
+        self._parse(parser, "file4", ["".join(TAGGED_CONLL)])
+        self.assertEqual(parser.close(), 0)
+
+        self.assertEqual(self._read_output("file1"), "".join(PARSED_CONLL))
+        self.assertEqual(self._read_output("file2"), PARSED_CONLL[1])
+        self.assertEqual(self._read_output("file3"), "")
+        self.assertEqual(self._read_output("file4"), "".join(PARSED_CONLL))
+
+    def test_discard_output(self):
+        parser = ParserProcess(
+            [sys.executable, DUMMY_PARSER],
+            os.path.join(self.dir, "parser.log")
+        )
+        with self.assertRaises(KeyError):
+            with parse(parser, "file1.txt", self.dir) as parser_input:
+                parser_input.write(TAGGED_CONLL[0])
+                raise KeyError()
+        self._parse(parser, "file2.txt", TAGGED_CONLL)
+        self.assertEqual(parser.close(), 0)
+        self.assertEqual(
+            sorted(os.listdir(self.dir)),
+            ["file2.conll", "parser.log"]
+        )
+
+    def test_parser_error(self):
+        parser = ParserProcess(
+            [sys.executable, DUMMY_PARSER, "--fail"],
+            os.path.join(self.dir, "parser.log")
+        )
+        self._parse(parser, "file.txt", TAGGED_CONLL)
+        self.assertNotEqual(parser.close(), 0)
+        # No partial output is left behind
+        self.assertEqual(os.listdir(self.dir), ["parser.log"])
 
-        popen_mock().wait.return_value = 1
-        data = []
+    def test_output_error(self):
+        def open_output(filename):
+            raise OSError("No space left on device")
 
-        open_mock = mock_open()
-        with patch("swe_pipeline.open", open_mock, create=True):
-            with self.assertRaises(SystemExit):
-                parse(options, "file.txt", data, "/tmp")
+        parser = ParserProcess(
+            [sys.executable, DUMMY_PARSER],
+            os.path.join(self.dir, "parser.log"),
+            open_output
+        )
+        # More than fits in the pipe buffers, which must not block when
+        # nothing reads the parser output
+        self._parse(parser, "file.txt", TAGGED_CONLL * 100000)
+        with self.assertRaises(OSError):
+            parser.close()
@@ -16,6 +16,7 @@ class TestProcessFile(unittest.TestCase):
         options.ner = ner
         options.parsed = parsed
         options.lemmatized = lemmatized
+        options.output_dir = "/output"
 
         return options
 
@@ -374,7 +375,8 @@ class TestProcessFile(unittest.TestCase):
         with open(os.devnull, 'w') as sys.stderr:
             open_mock = mock_open()
             with patch("swe_pipeline.open", open_mock, create=True):
-                process_file(options, "file.txt", "", models)
+                process_file(
+                    options, "file.txt", "", models, parser=MagicMock())
 
         self.assertEqual(run_tagging_mock.call_count, 2)
         self.assertEqual(parse_mock.call_count, 1)
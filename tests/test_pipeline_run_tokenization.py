@@ -1,4 +1,6 @@
-from swe_pipeline import run_tokenization
+import io
+from swe_pipeline import run_tokenization, read_blocks, read_chunks
+from tokenizer import build_sentences
 from textwrap import dedent
 import unittest
 from unittest.mock import patch, MagicMock, mock_open
@@ -24,7 +26,7 @@ class TestRunTokenization(unittest.TestCase):
 
         open_mock = mock_open()
         with patch("swe_pipeline.open", open_mock, create=True):
-            self.assertEqual(run_tokenization(options, "file.txt"), [])
+            self.assertEqual(list(run_tokenization(options, "file.txt")), [])
 
     @patch("swe_pipeline.build_sentences")
     def test_sentences(self, build_sentences_mock):
@@ -41,7 +43,7 @@ class TestRunTokenization(unittest.TestCase):
 
         open_mock = mock_open(read_data=text)
         with patch("swe_pipeline.open", open_mock, create=True):
-            self.assertEqual(run_tokenization(options, "file.txt"), [
+            self.assertEqual(list(run_tokenization(options, "file.txt")), [
                 ["Hej", "mitt", "namn", "är"],
                 ["Hej", "mitt", "namn", "är", "Slim", "Shady"],
             ])
@@ -66,7 +68,45 @@ class TestRunTokenization(unittest.TestCase):
 
         open_mock = mock_open(read_data=text)
         with patch("swe_pipeline.open", open_mock, create=True):
-            self.assertEqual(run_tokenization(options, "file.txt"), [
+            self.assertEqual(list(run_tokenization(options, "file.txt")), [
                 ["Hej", "mitt", "namn", "är"],
                 ["Hej", "mitt", "namn", "är", "Slim", "Shady"],
             ])
+
+    def test_read_blocks(self):
+        text = "a\n\nb\n\n\nc\n\n\n\nd\n"
+        for chunk_size in range(1, 6):
+            self.assertEqual(
+                list(read_blocks(io.StringIO(text), "\n\n", chunk_size)),
+                text.split("\n\n")
+            )
+
+    def test_read_chunks(self):
+        text = dedent("""
+            Hej mitt namn är Slim Shady. Vad heter du?
+
+            Jag heter bl.a.
+            Kalle.\n\n\n  \n
+            Det regnar, t.ex. i Uppsala 10 000 gånger!
+        """)
+        for chunk_size in range(1, 60):
+            chunks = list(read_chunks(io.StringIO(text), chunk_size))
+            self.assertEqual("".join(chunks), text)
+            self.assertEqual(
+                [sentence for chunk in chunks
+                    for sentence in build_sentences(chunk)],
+                list(build_sentences(text))
+            )
+
+    def test_read_chunks_long_paragraph(self):
+        # Paragraphs are never split, whatever their length
+        for text in ["Hej hopp.\n" * 10000, "Hej hopp. " * 10000]:
+            for prefix in ["", "Hej.\n\n"]:
+                chunks = list(read_chunks(io.StringIO(prefix + text), 1000))
+                self.assertEqual(chunks[-1].lstrip(), text)
+                self.assertEqual("".join(chunks), prefix + text)
+
+        text = "Hej hopp.\n\n" * 10000
+        chunks = list(read_chunks(io.StringIO(text), 1000))
+        self.assertEqual("".join(chunks), text)
+        self.assertLessEqual(max(len(chunk) for chunk in chunks), 2000)
@@ -1,4 +1,7 @@
+import gzip
+import os
 from swe_pipeline import run_pipeline
+import sys
 import tempfile
 import unittest
 from unittest.mock import patch, MagicMock
@@ -23,6 +26,8 @@ class TestRunner(unittest.TestCase):
         options.parsing_model = self.file.name
         options.lemmatized = lemmatized
         options.lemmatization_model = self.file.name
+        options.jobs = 1
+        options.parser_command = None
 
         return options
 
@@ -95,12 +100,14 @@ class TestRunner(unittest.TestCase):
     @patch("swe_pipeline.cleanup")
     @patch("swe_pipeline.tempfile")
     @patch("swe_pipeline.shutil")
+    @patch("swe_pipeline.ParserProcess")
     @patch("swe_pipeline.process_file")
     def test_one_with_parsed(
-        self, process_file_mock, shutil_mock, tempfile_mock, *args
+        self, process_file_mock, parser_mock, shutil_mock, tempfile_mock, *args
     ):
         options = self._default_options(parsed=True)
         tempfile_mock.mkdtemp.return_value = "/tmp/dir"
+        parser_mock().close.return_value = 0
 
         run_pipeline(options, ["file.txt"])
 
@@ -115,6 +122,7 @@ class TestRunner(unittest.TestCase):
         self.assertEqual(arguments[3]['lemmatizer'], None)
 
         self.assertEqual(shutil_mock.copy.call_count, 1)
+        self.assertEqual(parser_mock().close.call_count, 1)
 
     @patch("swe_pipeline.cleanup")
     @patch("swe_pipeline.tempfile")
@@ -163,3 +171,67 @@ class TestRunner(unittest.TestCase):
         self.assertEqual(arguments[3]['suc_tagger'], None)
         self.assertEqual(arguments[3]['ud_tagger'], None)
         self.assertEqual(arguments[3]['lemmatizer'], None)
+
+class FakeTagger:
+    def __init__(self, tagging_model):
+        pass
+
+    def tag(self, sentence):
+        return ["PM" if token[0].isupper() else "NN" for token in sentence]
+
+class TestParallelRunner(unittest.TestCase):
+    def _run(self, input_dir, filenames, jobs, compress=None):
+        output_dir = tempfile.mkdtemp(dir=input_dir)
+        options = MagicMock()
+        options.tokenized = True
+        options.tagged = True
+        options.ner = False
+        options.parsed = True
+        options.parser_command = "%s %s" % (
+            sys.executable,
+            os.path.join(os.path.dirname(__file__), "dummy_parser.py")
+        )
+        options.lemmatized = False
+        options.skip_tokenization = False
+        options.skip_segmentation = False
+        options.non_capitalized = False
+        options.no_delete = False
+        options.output_dir = output_dir
+        options.jobs = jobs
+        options.compress = compress
+        with open(os.devnull, 'w') as sys.stderr:
+            run_pipeline(options, filenames)
+        outputs = {}
+        for name in os.listdir(output_dir):
+            path = os.path.join(output_dir, name)
+            if compress == "gzip":
+                self.assertTrue(name.endswith(".gz"))
+                with gzip.open(path, 'rb') as f:
+                    outputs[name[:-3]] = f.read()
+            else:
+                with open(path, 'rb') as f:
+                    outputs[name] = f.read()
+        return outputs
+
+    @patch("swe_pipeline.SENTENCES_PER_CHUNK", 3)
+    @patch("swe_pipeline.SucTagger", FakeTagger)
+    def test_same_output(self):
+        with tempfile.TemporaryDirectory() as input_dir:
+            filenames = []
+            for i in range(5):
+                filename = os.path.join(input_dir, "file%d.txt" % i)
+                with open(filename, 'w', encoding='utf-8') as f:
+                    for j in range(10*i):
+                        print("Hej %d. Mitt namn är Slim Shady." % j, file=f)
+                filenames.append(filename)
+
+            serial = self._run(input_dir, filenames, 1)
+            self.assertEqual(len(serial), 15)
+            self.assertEqual(self._run(input_dir, filenames, 3), serial)
+            # Split all files into chunks
+            with patch("swe_pipeline.SPLIT_FILE_SIZE", 0):
+                self.assertEqual(self._run(input_dir, filenames, 3), serial)
+            self.assertEqual(
+                self._run(input_dir, filenames, 1, "gzip"), serial)
+            self.assertEqual(
+                self._run(input_dir, filenames, 3, "gzip"), serial)
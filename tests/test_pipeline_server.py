@@ -0,0 +1,114 @@
+import json
+import os
+from swe_pipeline import annotate_sentences, tokenize_input
+from swe_server import AnnotationServer, validate_server_options
+import io
+import sys
+import threading
+import unittest
+from unittest.mock import patch, MagicMock
+from urllib.request import urlopen
+from http.client import HTTPConnection
+
+class FakeTagger:
+    def __init__(self, tagging_model):
+        pass
+
+    def tag(self, sentence):
+        return ["PM" if token[0].isupper() else "NN" for token in sentence]
+
+class TestServer(unittest.TestCase):
+    def _default_options(self):
+        options = MagicMock()
+        options.all = False
+        options.tokenized = True
+        options.tagged = True
+        options.ner = False
+        options.parsed = False
+        options.lemmatized = False
+        options.skip_tokenization = False
+        options.skip_segmentation = False
+        options.non_capitalized = False
+        options.jobs = 2
+        options.host = "localhost"
+        options.port = 0
+        return options
+
+    @patch("swe_pipeline.SucTagger", FakeTagger)
+    def test_annotate(self):
+        options = self._default_options()
+        server = AnnotationServer(options)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        url = "http://%s:%d/" % server.server_address[:2]
+
+        texts = [
+            "Hej %d. Mitt namn är Slim Shady.\n\nVad heter du?" % i
+            for i in range(20)
+        ] + ["", "Åäö"]
+        results = [None] * len(texts)
+
+        def request(i):
+            with urlopen(url, texts[i].encode("utf-8")) as response:
+                results[i] = json.loads(response.read().decode("utf-8"))
+
+        try:
+            with open(os.devnull, 'w') as sys.stderr:
+                requests = [
+                    threading.Thread(target=request, args=(i,))
+                    for i in range(len(texts))
+                ]
+                for t in requests:
+                    t.start()
+                for t in requests:
+                    t.join()
+        finally:
+            server.shutdown()
+            server.server_close()
+            thread.join()
+
+        models = {"suc_tagger": FakeTagger(None)}
+        for text, result in zip(texts, results):
+            tokenized, tagged, _, _ = annotate_sentences(
+                options, tokenize_input(options, io.StringIO(text)), models)
+            self.assertEqual(result, {"tok": tokenized, "tag": tagged})
+
+    def test_no_parsing(self):
+        options = self._default_options()
+        options.parsed = True
+        with self.assertRaises(SystemExit):
+            validate_server_options(options)
+
+    def test_no_all(self):
+        options = self._default_options()
+        options.all = True
+        with self.assertRaises(SystemExit):
+            validate_server_options(options)
+
+    @patch("swe_pipeline.SucTagger", FakeTagger)
+    def test_invalid_length(self):
+        options = self._default_options()
+        server = AnnotationServer(options)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+
+        def request(length):
+            connection = HTTPConnection(*server.server_address[:2])
+            try:
+                connection.putrequest("POST", "/")
+                if length is not None:
+                    connection.putheader("Content-Length", length)
+                connection.endheaders()
+                return connection.getresponse().status
+            finally:
+                connection.close()
+
+        try:
+            with open(os.devnull, 'w') as sys.stderr:
+                self.assertEqual(request(None), 411)
+                self.assertEqual(request("-1"), 400)
+                self.assertEqual(request("abc"), 400)
+        finally:
+            server.shutdown()
+            server.server_close()
+            thread.join()
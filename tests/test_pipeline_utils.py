@@ -1,5 +1,7 @@
 import os
-from swe_pipeline import write_to_file, write_to_output, cleanup, output_filename
+from swe_pipeline import (
+    write_to_file, write_to_output, cleanup, output_filename, temp_filename
+)
 import sys
 from textwrap import dedent
 import unittest
@@ -17,16 +19,24 @@ class TestUtils(unittest.TestCase):
 
         """).lstrip())
 
-    @patch("swe_pipeline.shutil")
-    def test_write_to_output(self, shutil_mock):
+    @patch("swe_pipeline.os.replace")
+    def test_write_to_output(self, replace_mock):
         write_to_output([
-            (True, "file1", "/tmp1"),
-            (False, "file2", "/tmp2"),
-            (True, "file3", "/tmp3"),
+            ("/tmp1/file1", "/tmp1/.file1.tmp"),
+            ("/tmp3/file3", "/tmp3/.file3.tmp"),
         ])
         self.assertEqual(
-            shutil_mock.copy.call_args_list,
-            [call('file1', '/tmp1'), call('file3', '/tmp3')]
+            replace_mock.call_args_list,
+            [
+                call('/tmp1/.file1.tmp', '/tmp1/file1'),
+                call('/tmp3/.file3.tmp', '/tmp3/file3'),
+            ]
+        )
+
+    def test_temp_filename(self):
+        self.assertEqual(
+            temp_filename("/tmp/file.tok"),
+            "/tmp/.file.tok.%d.tmp" % os.getpid()
         )
 
     @patch("swe_pipeline.shutil")
@@ -1,4 +1,5 @@
 import os
+from concurrent.futures import ThreadPoolExecutor
 import tagger
 import unittest
 
@@ -22,6 +23,26 @@ class TestSucTagger(unittest.TestCase):
         expected = ('PN|UTR|SIN|DEF|SUB', 'VB|PRS|AKT', 'DT|UTR|SIN|IND', 'NN|UTR|SIN|IND|NOM', 'MAD')
         self.assertEqual(self.tagger.tag(test), expected)
 
+    def test_batch(self):
+        test = [["Jag", "har", "en", "dröm", "."], ("Jag",), []]
+        expected = [
+            ('PN|UTR|SIN|DEF|SUB', 'VB|PRS|AKT', 'DT|UTR|SIN|IND', 'NN|UTR|SIN|IND|NOM', 'MAD'),
+            self.tagger.tag(["Jag"]),
+            tuple(),
+        ]
+        self.assertEqual(self.tagger.tag_batch(test), expected)
+
+    def test_threads(self):
+        test = [["Jag", "har", "en", "dröm", "."], ["Jag"]] * 100
+        expected = [self.tagger.tag(sentence) for sentence in test]
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            self.assertEqual(
+                list(executor.map(self.tagger.tag, test)), expected)
+
+    def test_incorrect_batch_input(self):
+        with self.assertRaises(TypeError):
+            self.tagger.tag_batch(["Jag har en dröm."])
+
     def test_incorrect_string_input(self):
         test = "Jag har en dröm."
         with self.assertRaises(TypeError):
@@ -124,7 +124,7 @@ class PeekableIterator:
 
     def peek(self, n=None):
         self._fill_cache(n)
-        if not self._cache: raise StopIteration()
+        if len(self._cache) < (n or 1): raise StopIteration()
         if n is None:
             value = self._cache[0]
         else:
@@ -1,8 +1,10 @@
 from math import ceil, log2
+from array import array
 
-from taglexicon import hash32trans, hash64trans
-from fasthash import hash32, hash64
+from fasthash import hash32_many, hash64_many, \
+                     hashstr32_many, hashstr64_many
 from form import Lookup
+from perfecthash import PerfectHash
 
 class WCLexicon:
     def __init__(self, name, items, config):
@@ -18,18 +20,19 @@ class WCLexicon:
 
     def make_table(self):
         n_items = len(self.items)
-        size = 1 << (ceil(log2(n_items) + 0.5))
+        size = 1 << (ceil(log2(max(1, n_items)) + 0.5))
         table = [None] * size
+        keys = [key for key, _ in self.items]
         if self.lower:
-            fun = (lambda s: hash32trans(s.lower())) \
-                  if self.config.lexicon_hash_bits == 32 \
-                  else (lambda s: hash64trans(s.lower()))
+            keys = [key.lower() for key in keys]
+            key_hashes = hashstr32_many(keys) \
+                         if self.config.lexicon_hash_bits == 32 \
+                         else hashstr64_many(keys)
         else:
-            fun = (lambda s: hash32(1, s.encode('utf-8'))) \
-                  if self.config.lexicon_hash_bits == 32 \
-                  else (lambda s: hash64(1, s.encode('utf-8')))
-        for key, value in self.items:
-            key_hash = fun(key)
+            key_hashes = hash32_many(1, keys) \
+                         if self.config.lexicon_hash_bits == 32 \
+                         else hash64_many(1, keys)
+        for (key, value), key_hash in zip(self.items, key_hashes):
             i = key_hash % size
             while not table[i] is None:
                 if table[i][0] == key_hash: break
@@ -52,28 +55,52 @@ class WCLexicon:
 
     def c_emit(self, f):
         table = self.make_table()
+        hash_type = 'I' if self.config.lexicon_hash_bits == 32 else 'Q'
 
-        f.write('#define %s 0x%x\n\n' % (
-            self.c_size, len(table)))
+        entries = {}
+        if self.config.perfect_hash:
+            entries = dict(entry for entry in table if entry is not None)
+        # A perfect hash table for no keys would have no free slot for
+        # missing keys, so empty lexicons use the plain table.
+        perfect_hash = bool(entries)
 
-        def c_kv(entry):
-            if entry is None: return '{ 0, 0 }'
-            key_hash, value = entry
-            return '{ 0x%x, %d }' % (key_hash, value+1)
+        if perfect_hash:
+            perfect = PerfectHash(list(entries.keys()))
+            hashes = array(hash_type, perfect.keys)
+            values = array('I', (entries[h]+1 for h in perfect.keys))
+        else:
+            hashes = array(hash_type, (0 if entry is None else entry[0]
+                                       for entry in table))
+            values = array('I', (0 if entry is None else entry[1]+1
+                                 for entry in table))
 
-        body = '\n'.join(
-                '    %s%s' % (c_kv(t), '' if i == len(table)-1 else ',')
-                for i,t in enumerate(table))
+        f.write('#define %s 0x%x\n\n' % (self.c_size, len(hashes)))
 
-        f.write('static const hash%d_kv_label %s[%s] = {\n%s\n};\n\n' % (
-            self.config.lexicon_hash_bits, self.c_table, self.c_size, body))
+        arrays = [
+            ('uint%d_t' % self.config.lexicon_hash_bits,
+             '%s_hashes' % self.c_table, hashes),
+            ('label', '%s_values' % self.c_table, values)]
+        if perfect_hash:
+            arrays.append(('uint32_t', '%s_displacements' % self.c_table,
+                           perfect.displacements))
+        self.config.c_emit_data(f, self.name, arrays)
 
-        f.write('''
+        if perfect_hash:
+            f.write('''
+static inline label %s_get_wc(uint%d_t key) {
+    const size_t i = %s;
+    return (%s_hashes[i] == key)? %s_values[i] : 0;
+}
+''' % (self.name, self.config.lexicon_hash_bits,
+       perfect.c_lookup('key', '%s_displacements' % self.c_table),
+       self.c_table, self.c_table))
+        else:
+            f.write('''
 static inline label %s_get_wc(uint%d_t key) {
     size_t i = key & 0x%x;
     for (;;) {
-        if (%s[i].hash == key) return %s[i].value;
-        if (%s[i].value == 0) return 0;
+        if (%s_hashes[i] == key) return %s_values[i];
+        if (%s_values[i] == 0) return 0;
         i = (i + 1) & 0x%x;
     }
 }